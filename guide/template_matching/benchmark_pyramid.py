@@ -0,0 +1,120 @@
+"""
+Benchmark coarse-to-fine template search against the exhaustive search.
+
+Every layout is matched against every element template once exhaustively
+(the reference) and once per coarse margin in coarse-to-fine mode. Reported
+per mode: total time spent in cv2.matchTemplate, wall-clock time, and how
+well the detections (after NMS) agree with the reference:
+
+    python benchmark_pyramid.py --margins 0.05 0.15 0.3 --limit 5
+"""
+
+import argparse
+import glob
+import io
+import os
+import time
+from contextlib import redirect_stdout
+from typing import Dict, List, Tuple
+
+import cv2
+import numpy as np
+
+from template_bank import TemplateBank
+from matcher import MultiScaleTemplateMatcher
+
+Match = Tuple[int, int, int, int, float]
+
+
+def iou(a: Match, b: Match) -> float:
+    ax, ay, aw, ah = a[:4]
+    bx, by, bw, bh = b[:4]
+    inter_w = max(0, min(ax + aw, bx + bw) - max(ax, bx))
+    inter_h = max(0, min(ay + ah, by + bh) - max(ay, by))
+    inter = inter_w * inter_h
+    return inter / float(aw * ah + bw * bh - inter)
+
+
+def count_agreement(reference: List[Match], candidate: List[Match], min_iou: float) -> int:
+    """Count reference detections that have a same-sized candidate detection overlapping by at least min_iou."""
+    found = 0
+    for ref in reference:
+        if any(c[2] == ref[2] and c[3] == ref[3] and iou(ref, c) >= min_iou for c in candidate):
+            found += 1
+    return found
+
+
+def run_mode(matcher: MultiScaleTemplateMatcher, layouts: List[Tuple[str, np.ndarray]],
+             template_bank: TemplateBank) -> Tuple[Dict[Tuple[str, str], List[Match]], float, float]:
+    """
+    Match every template against every layout.
+
+    Returns:
+        Detections keyed by (layout, element), total cv2 match time and wall-clock time
+    """
+    detections = {}
+    start_time = time.time()
+    # The matcher reports every template match on stdout
+    with redirect_stdout(io.StringIO()):
+        for layout_name, layout_gray in layouts:
+            for element_name in template_bank.names:
+                matches, _ = matcher.multi_scale_template_match(
+                    layout_gray, template_bank.template(element_name), template_bank.scaled_templates(element_name))
+                detections[(layout_name, element_name)] = matches
+    wall_time = time.time() - start_time
+    return detections, matcher.metrics.stages['cv2_template_match'].sum, wall_time
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--layouts', nargs='+', default=['../screenshots/layouts', '../screenshots/layout_variations'])
+    parser.add_argument('--elements', default='../screenshots/elements')
+    parser.add_argument('--scales', nargs='+', type=float, default=[0.5, 0.75, 1.0, 1.25, 1.5, 2.0])
+    parser.add_argument('--threshold', type=float, default=0.6)
+    parser.add_argument('--coarse-factor', type=float, default=0.5)
+    parser.add_argument('--margins', nargs='+', type=float, default=[0.05, 0.15, 0.3],
+                        help='coarse margins to try; larger margins keep more candidates')
+    parser.add_argument('--min-iou', type=float, default=0.5)
+    parser.add_argument('--limit', type=int, default=0, help='only use the first N layouts (0 = all)')
+    parser.add_argument('--cache-dir', default='.template_cache')
+    args = parser.parse_args()
+
+    layout_files = []
+    for layouts_dir in args.layouts:
+        layout_files.extend(sorted(glob.glob(os.path.join(layouts_dir, '*.png'))))
+    if args.limit:
+        layout_files = layout_files[:args.limit]
+    layouts = []
+    for layout_file in layout_files:
+        layout_image = cv2.imread(layout_file)
+        if layout_image is None:
+            print(f'Could not load layout image: {layout_file}')
+            continue
+        layouts.append((layout_file, cv2.cvtColor(layout_image, cv2.COLOR_BGR2GRAY)))
+
+    element_files = sorted(glob.glob(os.path.join(args.elements, '*.png')))
+    template_bank = TemplateBank.from_files(element_files, args.scales, args.cache_dir)
+    print(f'📚 {len(layouts)} layouts x {len(template_bank)} templates x {len(args.scales)} scales, threshold {args.threshold}')
+
+    exhaustive = MultiScaleTemplateMatcher(scales=args.scales, threshold=args.threshold)
+    reference, ref_cv2_time, ref_wall_time = run_mode(exhaustive, layouts, template_bank)
+    ref_total = sum(len(matches) for matches in reference.values())
+
+    print(f"\n{'mode':<24} {'cv2 time':>10} {'wall time':>10} {'speedup':>8} {'detections':>11} {'recall':>8} {'precision':>10}")
+    print(f"{'exhaustive':<24} {ref_cv2_time:>9.2f}s {ref_wall_time:>9.2f}s {1.0:>7.2f}x {ref_total:>11} {1.0:>8.3f} {1.0:>10.3f}")
+
+    for margin in args.margins:
+        matcher = MultiScaleTemplateMatcher(scales=args.scales, threshold=args.threshold, search_mode='coarse_to_fine',
+                                            coarse_factor=args.coarse_factor, coarse_margin=margin)
+        detections, cv2_time, wall_time = run_mode(matcher, layouts, template_bank)
+        total = sum(len(matches) for matches in detections.values())
+        recalled = sum(count_agreement(reference[key], detections[key], args.min_iou) for key in reference)
+        confirmed = sum(count_agreement(detections[key], reference[key], args.min_iou) for key in reference)
+        recall = recalled / ref_total if ref_total else 1.0
+        precision = confirmed / total if total else 1.0
+        mode = f'coarse_to_fine m={margin:g}'
+        print(f'{mode:<24} {cv2_time:>9.2f}s {wall_time:>9.2f}s {ref_wall_time / wall_time:>7.2f}x {total:>11} {recall:>8.3f} {precision:>10.3f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""
+Compare a template matching run against a baseline metrics.json and flag
+per-stage regressions.
+
+A stage regresses when its average time grows by more than --tolerance
+(relative) and by more than --min-delta seconds. When both files carry
+per-stage statistics (detailed_metrics.stage_statistics), the p90 is checked
+the same way. Exits with status 1 if any stage regressed:
+
+    python compare_metrics.py baseline_metrics.json metrics.json --tolerance 0.1
+"""
+
+import argparse
+import json
+import sys
+from typing import Any, Dict, List, Optional, Tuple
+
+PREFIX = 'average_'
+SUFFIX = '_time_seconds'
+
+
+def load_metrics(path: str) -> Dict[str, Any]:
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def stage_values(metrics: Dict[str, Any]) -> Dict[str, Dict[str, float]]:
+    """Per-stage {'mean': ..., 'p90': ...} from either metrics.json schema."""
+    stages: Dict[str, Dict[str, float]] = {}
+    for key, value in metrics.get('summary', {}).items():
+        if key.startswith(PREFIX) and key.endswith(SUFFIX):
+            stages.setdefault(key[len(PREFIX):-len(SUFFIX)], {})['mean'] = value
+    statistics = metrics.get('detailed_metrics', {}).get('stage_statistics', {})
+    for stage, values in statistics.items():
+        stages.setdefault(stage, {})['p90'] = values['p90_seconds']
+    return stages
+
+
+def compare(baseline: Dict[str, Any], current: Dict[str, Any], tolerance: float,
+            min_delta: float) -> List[Tuple[str, str, float, float, bool]]:
+    """
+    Returns:
+        (stage, statistic, baseline value, current value, regressed) rows
+    """
+    baseline_stages = stage_values(baseline)
+    current_stages = stage_values(current)
+    rows = []
+    for stage in baseline_stages:
+        if stage not in current_stages:
+            continue
+        for statistic in ('mean', 'p90'):
+            old: Optional[float] = baseline_stages[stage].get(statistic)
+            new: Optional[float] = current_stages[stage].get(statistic)
+            if old is None or new is None:
+                continue
+            regressed = new - old > min_delta and new > old * (1 + tolerance)
+            rows.append((stage, statistic, old, new, regressed))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('baseline', help='baseline metrics.json')
+    parser.add_argument('current', help='metrics.json of the run to check')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='allowed relative slowdown per stage')
+    parser.add_argument('--min-delta', type=float, default=0.001,
+                        help='ignore slowdowns smaller than this many seconds')
+    args = parser.parse_args()
+
+    rows = compare(load_metrics(args.baseline), load_metrics(args.current), args.tolerance, args.min_delta)
+    if not rows:
+        print('No common stages to compare')
+        sys.exit(2)
+
+    print(f"{'stage':<20} {'stat':<5} {'baseline':>11} {'current':>11} {'change':>8}")
+    regressions = 0
+    for stage, statistic, old, new, regressed in rows:
+        change = f'{(new - old) / old * 100:+.1f}%' if old else 'n/a'
+        flag = '  ❌ regression' if regressed else ''
+        print(f'{stage:<20} {statistic:<5} {old:>10.4f}s {new:>10.4f}s {change:>8}{flag}')
+        regressions += regressed
+
+    if regressions:
+        print(f'\n{regressions} stage statistics regressed by more than {args.tolerance * 100:.0f}%')
+        sys.exit(1)
+    print('\n✅ No regressions')
+
+
+if __name__ == '__main__':
+    main()
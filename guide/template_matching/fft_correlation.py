@@ -0,0 +1,161 @@
+import cv2
+import numpy as np
+from typing import Iterator, List, Tuple
+
+try:
+    import scipy.fft as fft_module
+    _FFT_KWARGS = {'workers': -1}
+except ImportError:
+    fft_module = np.fft
+    _FFT_KWARGS = {}
+
+
+def _fast_length(n: int) -> int:
+    if fft_module is np.fft:
+        return cv2.getOptimalDFTSize(n)
+    return fft_module.next_fast_len(n, real=True)
+
+
+class FFTCorrelator:
+    """
+    TM_CCOEFF_NORMED template matching against one layout with the layout's
+    transform and window statistics computed once.
+
+    cv2.matchTemplate transforms the layout again for every template and
+    scale. Here the layout's real FFT (padded to a fast transform size) and
+    its integral images are computed on construction; templates are grouped
+    by padded size (their height and width rounded up to PAD_STEP), and each
+    batch of a group is zero-mean'd, padded to that same size, transformed
+    together, multiplied with the conjugate layout spectrum and
+    inverse-transformed in one call.
+    Normalisation by the template and window energies follows OpenCV's, so the
+    result maps equal cv2.matchTemplate(image, template, cv2.TM_CCOEFF_NORMED)
+    up to floating-point rounding (OpenCV's single-precision sums drift most in
+    nearly flat windows, where dtype=np.float64 here gives the exact score).
+
+    scipy.fft is used when installed (multi-threaded, float32 transforms),
+    otherwise numpy.fft.
+    """
+
+    PAD_STEP = 32
+
+    def __init__(self, image: np.ndarray, max_batch_bytes: int = 256 * 1024 * 1024, dtype: type = np.float32):
+        """
+        Args:
+            image: Single-channel layout image
+            max_batch_bytes: Upper bound on the spectra held at once; larger
+                batches are split
+            dtype: Precision of the transforms (np.float32, like OpenCV's own
+                DFT path, or np.float64); window statistics always use float64
+        """
+        self.image_shape = image.shape[:2]
+        self.max_batch_bytes = max_batch_bytes
+        self.dtype = dtype
+        self.fft_shape = tuple(_fast_length(n) for n in self.image_shape)
+        self.image_spectrum = fft_module.rfft2(image.astype(dtype), s=self.fft_shape, **_FFT_KWARGS)
+        self.sum, self.sqsum = cv2.integral2(image, sdepth=cv2.CV_64F, sqdepth=cv2.CV_64F)
+
+    def match(self, template: np.ndarray) -> np.ndarray:
+        return self.match_batch([template])[0]
+
+    def match_batch(self, templates: List[np.ndarray]) -> List[np.ndarray]:
+        """
+        Correlate several templates against the layout.
+
+        Returns:
+            One float32 result map per template, shaped like cv2.matchTemplate's
+        """
+        results = [None] * len(templates)
+        for batch, batch_results in self.iter_batches(templates):
+            for i, result in zip(batch, batch_results):
+                results[i] = result
+        return results
+
+    def padded_shape(self, template: np.ndarray) -> Tuple[int, int]:
+        """Size of the block `template` is batched in; templates of the same block share transforms."""
+        step = self.PAD_STEP
+        return tuple(-(-n // step) * step for n in template.shape[:2])
+
+    def iter_batches(self, templates: List[np.ndarray]) -> Iterator[Tuple[List[int], List[np.ndarray]]]:
+        """
+        Correlate templates (e.g. every scale of every element of a library)
+        one batch at a time, yielding the batch's template indices and result
+        maps. Callers can reduce each batch's maps before the next one is
+        computed instead of holding maps for all templates.
+        """
+        batch_size = max(1, self.max_batch_bytes // self.image_spectrum.nbytes)
+        groups = {}
+        for i, template in enumerate(templates):
+            groups.setdefault(self.padded_shape(template), []).append(i)
+        for shape in sorted(groups):
+            group = groups[shape]
+            for start in range(0, len(group), batch_size):
+                batch = group[start:start + batch_size]
+                yield batch, self._match_batch([templates[i] for i in batch])
+
+    def _match_batch(self, templates: List[np.ndarray]) -> List[np.ndarray]:
+        image_h, image_w = self.image_shape
+        fft_h, fft_w = self.fft_shape
+        batch_h = max(template.shape[0] for template in templates)
+        batch_w = max(template.shape[1] for template in templates)
+        if batch_h > image_h or batch_w > image_w:
+            raise ValueError(f"Templates up to {batch_w}x{batch_h} do not fit the {image_w}x{image_h} image")
+
+        # Zero-mean templates, stacked into the smallest block that holds all of them
+        stack = np.zeros((len(templates), batch_h, batch_w), dtype=self.dtype)
+        template_norms = []
+        for i, template in enumerate(templates):
+            h, w = template.shape[:2]
+            centred = template.astype(np.float64)
+            centred -= centred.mean()
+            stack[i, :h, :w] = centred
+            template_norms.append(np.sqrt(np.sum(centred * centred)))
+
+        # 2D transform of the zero-padded templates, skipping the all-zero rows:
+        # transform the template rows, pad, then transform the columns
+        spectra = fft_module.rfft(stack, n=fft_w, axis=-1, **_FFT_KWARGS)
+        spectra = fft_module.fft(spectra, n=fft_h, axis=-2, **_FFT_KWARGS)
+
+        # Multiplying by the conjugate template spectrum gives the (circular)
+        # cross-correlation; the FFT size covers the whole layout, so valid
+        # positions never wrap around
+        spectra = np.conj(spectra, out=spectra)
+        spectra *= self.image_spectrum
+        spectra = fft_module.ifft(spectra, axis=-2, **_FFT_KWARGS)
+
+        results = []
+        for i, template in enumerate(templates):
+            h, w = template.shape[:2]
+            result_h, result_w = image_h - h + 1, image_w - w + 1
+            numerator = fft_module.irfft(spectra[i, :result_h], n=fft_w, axis=-1, **_FFT_KWARGS)[:, :result_w]
+            results.append(self._normalize(numerator, template_norms[i], h, w))
+        return results
+
+    def _window_sums(self, integral: np.ndarray, h: int, w: int) -> np.ndarray:
+        return integral[h:, w:] - integral[:-h, w:] - integral[h:, :-w] + integral[:-h, :-w]
+
+    def _normalize(self, numerator: np.ndarray, template_norm: float, h: int, w: int) -> np.ndarray:
+        # A flat template correlates perfectly everywhere, as in OpenCV
+        if template_norm * template_norm / (h * w) < np.finfo(np.float64).eps:
+            return np.ones(numerator.shape, dtype=np.float32)
+
+        window_sum = self._window_sums(self.sum, h, w)
+        window_norm = self._window_sums(self.sqsum, h, w)
+        window_sum *= window_sum
+        window_sum /= h * w
+        window_norm -= window_sum
+        np.maximum(window_norm, 0, out=window_norm)
+        np.sqrt(window_norm, out=window_norm)
+        window_norm *= template_norm
+        window_norm = window_norm.astype(np.float32)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            result = numerator.astype(np.float32) / window_norm
+        # Same clamping as OpenCV: scores slightly above 1 from rounding become +-1,
+        # anything else outside the range (or a flat window) becomes 0
+        outside = ~(np.abs(numerator) < window_norm)
+        if outside.any():
+            ys, xs = np.nonzero(outside)
+            magnitude = np.abs(numerator[ys, xs])
+            result[ys, xs] = np.where(magnitude < window_norm[ys, xs] * 1.125, np.sign(numerator[ys, xs]), 0.0)
+        return result
@@ -0,0 +1,186 @@
+import cv2
+import numpy as np
+import time
+from typing import Dict, List, Optional, Tuple
+from matcher import MultiScaleTemplateMatcher, non_max_suppression
+from template_bank import TemplateBank
+
+Match = Tuple[int, int, int, int, float]
+
+
+class IncrementalMatcher:
+    """
+    Matches element templates on successive frames of a live screen, redoing
+    only the work the changes since the previous frame require.
+
+    The new frame is diffed against the previous one and the changed pixels
+    are grouped into tiles; connected dirty tiles form the dirty rectangles.
+    A detection from the previous frame that touches no dirty tile is carried
+    over after re-scoring it at its known position and scale (one template-
+    sized match), and dropped if it falls below the threshold. Each dirty
+    rectangle, grown at every scale by that scale's template size, is searched
+    again with the wrapped MultiScaleTemplateMatcher; the new detections are
+    merged with the carried ones by non-maximum suppression.
+
+    Apart from the diff itself, per-frame cost follows the changed area: an
+    unchanged frame only re-scores the known detections. When more than
+    `full_search_fraction` of the tiles changed (e.g. a page navigation), the
+    frame is searched from scratch instead.
+    """
+
+    def __init__(self, matcher: MultiScaleTemplateMatcher, template_bank: TemplateBank, tile_size: int = 32,
+                 diff_threshold: int = 0, full_search_fraction: float = 0.5):
+        """
+        Args:
+            matcher: Matcher used for the searches; its scales must be the bank's
+            template_bank: Pre-scaled templates of the elements to track
+            tile_size: Side in pixels of the tiles changes are grouped into
+            diff_threshold: Pixel differences up to this value are not changes
+                (raise it for lossy captures)
+            full_search_fraction: Fraction of dirty tiles above which the whole
+                frame is searched
+        """
+        if list(matcher.scales) != list(template_bank.scales):
+            raise ValueError(f"Matcher scales {matcher.scales} differ from the template bank's {template_bank.scales}")
+        if tile_size <= 0:
+            raise ValueError(f"tile_size must be positive, got {tile_size}")
+        self.matcher = matcher
+        self.template_bank = template_bank
+        self.tile_size = tile_size
+        self.diff_threshold = diff_threshold
+        self.full_search_fraction = full_search_fraction
+        self.last_stats: Dict[str, float] = {}
+        self.reset()
+
+    def reset(self) -> None:
+        """Forget the previous frame, so the next one is searched from scratch."""
+        self._frame: Optional[np.ndarray] = None
+        self._detections: Dict[str, List[Match]] = {}
+
+    def match_frame(self, frame: np.ndarray, element_names: List[str]) -> Dict[str, List[Match]]:
+        """
+        Detect elements on the next frame.
+
+        Args:
+            frame: Grayscale screenshot
+            element_names: Template names (as in the TemplateBank) to detect
+
+        Returns:
+            (x, y, w, h, confidence) matches per element name
+        """
+        start_time = time.time()
+        if self._frame is None or self._frame.shape != frame.shape:
+            tile_mask = None
+        else:
+            tile_mask = self._dirty_tiles(frame)
+        diff_time = time.time() - start_time
+
+        dirty_fraction = 1.0 if tile_mask is None else float(tile_mask.mean())
+        full_search = dirty_fraction > self.full_search_fraction
+        rects = [] if full_search else self._dirty_rects(tile_mask, frame.shape)
+
+        verify_time = 0.0
+        search_time = 0.0
+        carried_count = 0
+        detections = {}
+        for element_name in element_names:
+            if full_search or element_name not in self._detections:
+                search_start = time.time()
+                detections[element_name], _ = self.matcher.multi_scale_template_match(
+                    frame, self.template_bank.template(element_name), self.template_bank.scaled_templates(element_name))
+                search_time += time.time() - search_start
+                continue
+
+            verify_start = time.time()
+            carried = self._verify(frame, element_name, [
+                match for match in self._detections[element_name] if not self._touches(match, tile_mask)])
+            carried_count += len(carried)
+            verify_time += time.time() - verify_start
+
+            search_start = time.time()
+            found = [match for rect in rects for match in self._search_rect(frame, element_name, rect)
+                     if self._touches(match, tile_mask)]
+            if found:
+                merged = carried + found
+                boxes = np.array([match[:4] for match in merged])
+                scores = np.array([match[4] for match in merged])
+                carried = [merged[i] for i in non_max_suppression(boxes, scores)]
+            detections[element_name] = carried
+            search_time += time.time() - search_start
+
+        self._frame = frame.copy()
+        self._detections = detections
+        self.last_stats = {
+            'dirty_fraction': dirty_fraction,
+            'dirty_rects': len(rects),
+            'full_search': full_search,
+            'carried_matches': carried_count,
+            'diff_time_seconds': diff_time,
+            'verify_time_seconds': verify_time,
+            'search_time_seconds': search_time,
+            'frame_time_seconds': time.time() - start_time
+        }
+        return detections
+
+    def _dirty_tiles(self, frame: np.ndarray) -> np.ndarray:
+        """Boolean grid with one cell per tile, True where any pixel changed."""
+        changed = cv2.absdiff(frame, self._frame) > self.diff_threshold
+        tile = self.tile_size
+        rows = -(-frame.shape[0] // tile)
+        cols = -(-frame.shape[1] // tile)
+        padded = np.zeros((rows * tile, cols * tile), dtype=bool)
+        padded[:frame.shape[0], :frame.shape[1]] = changed
+        return padded.reshape(rows, tile, cols, tile).any(axis=(1, 3))
+
+    def _dirty_rects(self, tile_mask: np.ndarray, shape: Tuple[int, ...]) -> List[Tuple[int, int, int, int]]:
+        """Pixel (x0, y0, x1, y1) bounds of each group of connected dirty tiles."""
+        count, _, stats, _ = cv2.connectedComponentsWithStats(tile_mask.astype(np.uint8), connectivity=8)
+        tile = self.tile_size
+        rects = []
+        for left, top, width, height, _ in stats[1:count]:
+            rects.append((left * tile, top * tile,
+                          min((left + width) * tile, shape[1]), min((top + height) * tile, shape[0])))
+        return rects
+
+    def _touches(self, match: Match, tile_mask: np.ndarray) -> bool:
+        x, y, w, h = match[:4]
+        tile = self.tile_size
+        return bool(tile_mask[y // tile:(y + h - 1) // tile + 1, x // tile:(x + w - 1) // tile + 1].any())
+
+    def _verify(self, frame: np.ndarray, element_name: str, matches: List[Match]) -> List[Match]:
+        """Re-score matches at their position and scale, keeping those still above the threshold."""
+        if not matches:
+            return []
+        templates = {template.shape[:2]: template
+                     for _, template in self.template_bank.scaled_templates(element_name) if template is not None}
+        verified = []
+        for x, y, w, h, _ in matches:
+            template = templates.get((h, w))
+            if template is None:
+                continue
+            score = float(cv2.matchTemplate(frame[y:y + h, x:x + w], template, self.matcher.method)[0, 0])
+            if score >= self.matcher.threshold:
+                verified.append((x, y, w, h, score))
+        return verified
+
+    def _search_rect(self, frame: np.ndarray, element_name: str, rect: Tuple[int, int, int, int]) -> List[Match]:
+        """
+        Search, one scale at a time, the part of the frame where a match of
+        that scale could overlap the dirty rectangle.
+        """
+        scaled_templates = self.template_bank.scaled_templates(element_name)
+        template = self.template_bank.template(element_name)
+        matches = []
+        for i, (scale, scaled_template) in enumerate(scaled_templates):
+            if scaled_template is None:
+                continue
+            # One extra pixel on each side keeps the peak test's 3x3
+            # neighbourhood of every position that overlaps the rectangle
+            margin_h, margin_w = scaled_template.shape[:2]
+            x0, y0, x1, y1 = rect
+            x0, y0 = max(0, x0 - margin_w), max(0, y0 - margin_h)
+            x1, y1 = min(frame.shape[1], x1 + margin_w), min(frame.shape[0], y1 + margin_h)
+            only_scale = [(s, t if j == i else None) for j, (s, t) in enumerate(scaled_templates)]
+            found, _ = self.matcher.multi_scale_template_match(frame[y0:y1, x0:x1], template, only_scale)
+            matches.extend((x + x0, y + y0, w, h, score) for x, y, w, h, score in found)
+        return matches
@@ -0,0 +1,798 @@
+import cv2
+import numpy as np
+import json
+import time
+import os
+import glob
+import io
+import shutil
+import tempfile
+import zlib
+import multiprocessing as mp
+import multiprocessing.util as mp_util
+from contextlib import redirect_stdout
+from typing import List, Tuple, Dict, Any, Optional
+from template_bank import TemplateBank
+from fft_correlation import FFTCorrelator
+from plan_index import PlanIndex
+from metrics_recorder import MetricsRecorder
+from output_writer import OutputWriter
+
+class MultiScaleTemplateMatcher:
+    SEARCH_MODES = ('exhaustive', 'coarse_to_fine')
+    NMS_SCOPES = ('element', 'layout')
+    MATCH_BACKENDS = ('opencv', 'fft')
+    
+    def __init__(self, scales: Optional[List[float]] = None, threshold: float = 0.7,
+                 method: int = cv2.TM_CCOEFF_NORMED, search_mode: str = 'exhaustive',
+                 coarse_factor: float = 0.5, coarse_margin: float = 0.15, roi_padding: int = 2,
+                 min_coarse_size: int = 8, nms_scope: str = 'element', match_backend: str = 'opencv',
+                 verbosity: int = 2, report_interval: int = 1, keep_samples: bool = False):
+        """
+        Initialize the multi-scale template matcher.
+        
+        Args:
+            scales: List of scales to try (default: [0.5, 0.75, 1.0, 1.25, 1.5])
+            threshold: Minimum matching confidence threshold
+            method: cv2.matchTemplate method; must score higher for better matches
+            search_mode: 'exhaustive' matches every scale against the full layout;
+                'coarse_to_fine' finds candidates on a downsampled layout first and
+                re-matches only regions around them at full resolution
+            coarse_factor: Downsampling factor of the coarse layout (coarse_to_fine only)
+            coarse_margin: How far below threshold a coarse score may be and still
+                become a candidate; larger values trade speed for recall
+            roi_padding: Extra full-resolution pixels searched around each candidate
+            min_coarse_size: Scales whose template would shrink below this many pixels
+                at the coarse level are matched exhaustively instead
+            nms_scope: 'element' suppresses overlapping matches of the same element only;
+                'layout' additionally suppresses matches of different elements overlapping
+                a more confident match in process_layout
+            match_backend: 'opencv' runs cv2.matchTemplate per template and scale;
+                'fft' transforms each layout once and correlates the templates of all
+                elements against it in batches of equal padded size (TM_CCOEFF_NORMED
+                only). Regions
+                re-matched in coarse_to_fine mode always use OpenCV
+            verbosity: 0 prints only run-level messages, 1 adds per-layout progress,
+                2 adds per-operation timings
+            report_interval: Print running stage statistics every this many layouts
+                (0 disables them); needs verbosity >= 1
+            keep_samples: Keep every individual timing for metrics.json in addition
+                to the fixed-size per-stage statistics
+        """
+        if search_mode not in self.SEARCH_MODES:
+            raise ValueError(f"Unknown search mode {search_mode!r}, expected one of {self.SEARCH_MODES}")
+        if nms_scope not in self.NMS_SCOPES:
+            raise ValueError(f"Unknown NMS scope {nms_scope!r}, expected one of {self.NMS_SCOPES}")
+        if match_backend not in self.MATCH_BACKENDS:
+            raise ValueError(f"Unknown match backend {match_backend!r}, expected one of {self.MATCH_BACKENDS}")
+        if match_backend == 'fft' and method != cv2.TM_CCOEFF_NORMED:
+            raise ValueError("The fft match backend only implements cv2.TM_CCOEFF_NORMED")
+        self.scales = scales or [0.5, 0.75, 1.0, 1.25, 1.5]
+        self.threshold = threshold
+        self.method = method
+        self.search_mode = search_mode
+        self.coarse_factor = coarse_factor
+        self.coarse_margin = coarse_margin
+        self.roi_padding = roi_padding
+        self.min_coarse_size = min_coarse_size
+        self.nms_scope = nms_scope
+        self.match_backend = match_backend
+        self._coarse_layout: Optional[Tuple[np.ndarray, np.ndarray]] = None
+        self._correlator: Optional[Tuple[np.ndarray, FFTCorrelator]] = None
+        self.verbosity = verbosity
+        self.report_interval = report_interval
+        self.keep_samples = keep_samples
+        self.metrics = MetricsRecorder(keep_samples)
+    
+    def config(self) -> Dict[str, Any]:
+        """Constructor arguments that reproduce this matcher (e.g. in a worker process)."""
+        return {
+            'scales': self.scales,
+            'threshold': self.threshold,
+            'method': self.method,
+            'search_mode': self.search_mode,
+            'coarse_factor': self.coarse_factor,
+            'coarse_margin': self.coarse_margin,
+            'roi_padding': self.roi_padding,
+            'min_coarse_size': self.min_coarse_size,
+            'nms_scope': self.nms_scope,
+            'match_backend': self.match_backend,
+            'verbosity': self.verbosity,
+            'report_interval': self.report_interval,
+            'keep_samples': self.keep_samples
+        }
+    
+    def _log(self, level: int, message: str) -> None:
+        if self.verbosity >= level:
+            print(message)
+    
+    def multi_scale_template_match(self, image: np.ndarray, template: np.ndarray,
+                                   scaled_templates: Optional[List[Tuple[float, Optional[np.ndarray]]]] = None) -> Tuple[List[Tuple[int, int, int, int, float]], float]:
+        """
+        Perform multi-scale template matching.
+        
+        Args:
+            image: The main image to search in
+            template: The template to search for
+            scaled_templates: Optional pre-scaled (scale, template) pairs for self.scales,
+                e.g. from TemplateBank.scaled_templates; skips resizing the template
+            
+        Returns:
+            List of (x, y, w, h, confidence) tuples and max confidence
+        """
+        start_time = time.time()
+        
+        candidate_boxes = []
+        candidate_scores = []
+        max_confidence = 0
+        cv2_match_time_total = 0
+        preprocessing_time_total = 0
+        
+        # Get template dimensions
+        template_h, template_w = template.shape[:2]
+        
+        # Scale the template (preprocessing step)
+        preprocess_start = time.time()
+        usable_templates = []
+        for i, scale in enumerate(self.scales):
+            if scaled_templates is not None:
+                scaled_template = scaled_templates[i][1]
+                if scaled_template is None:
+                    continue
+                scaled_h, scaled_w = scaled_template.shape[:2]
+            else:
+                scaled_w = int(template_w * scale)
+                scaled_h = int(template_h * scale)
+                
+                if scaled_w <= 0 or scaled_h <= 0:
+                    continue
+                
+            if scaled_w > image.shape[1] or scaled_h > image.shape[0]:
+                continue
+                
+            if scaled_templates is None:
+                scaled_template = cv2.resize(template, (scaled_w, scaled_h))
+            usable_templates.append(scaled_template)
+        preprocessing_time_total += time.time() - preprocess_start
+        
+        # The FFT backend correlates all scales against the layout in one batch
+        full_results = None
+        if self.match_backend == 'fft' and self.search_mode == 'exhaustive' and usable_templates:
+            cv2_match_start = time.time()
+            full_results = self._layout_correlator(image).match_batch(usable_templates)
+            cv2_match_time_total += time.time() - cv2_match_start
+        
+        for k, scaled_template in enumerate(usable_templates):
+            scaled_h, scaled_w = scaled_template.shape[:2]
+            
+            if self.search_mode == 'coarse_to_fine':
+                regions, coarse_time, coarse_preprocessing_time = self._coarse_candidate_regions(image, scaled_template)
+                cv2_match_time_total += coarse_time
+                preprocessing_time_total += coarse_preprocessing_time
+            else:
+                regions = None
+            
+            full_layout = regions is None
+            if full_layout:
+                regions = [(0, 0, image.shape[1] - scaled_w + 1, image.shape[0] - scaled_h + 1)]
+            
+            # Bounding boxes of neighbouring candidate groups can overlap; track
+            # searched positions so none is reported twice
+            searched = np.zeros((image.shape[0] - scaled_h + 1, image.shape[1] - scaled_w + 1), dtype=bool) if len(regions) > 1 else None
+            
+            for x0, y0, x1, y1 in regions:
+                # Perform template matching (core CV2 operation) on the region's
+                # window of the layout; scores match the full-layout ones up to rounding
+                cv2_match_start = time.time()
+                if full_results is not None:
+                    result = full_results[k]
+                elif full_layout and self.match_backend == 'fft':
+                    result = self._layout_correlator(image).match(scaled_template)
+                else:
+                    result = cv2.matchTemplate(image[y0:y1 + scaled_h - 1, x0:x1 + scaled_w - 1], scaled_template, self.method)
+                cv2_match_time_total += time.time() - cv2_match_start
+                
+                # Keep local maxima of the score map that exceed the threshold
+                peaks = extract_peaks(result, self.threshold)
+                if searched is not None:
+                    peaks &= ~searched[y0:y1, x0:x1]
+                    searched[y0:y1, x0:x1] = True
+                ys, xs = np.nonzero(peaks)
+                if len(xs) == 0:
+                    continue
+                
+                # Add matches with bounding boxes
+                candidate_boxes.append(np.column_stack((x0 + xs, y0 + ys, np.full(len(xs), scaled_w), np.full(len(xs), scaled_h))))
+                candidate_scores.append(result[ys, xs])
+        
+        best_matches, max_confidence = self._select_matches(candidate_boxes, candidate_scores)
+        self._record_match(cv2_match_time_total, preprocessing_time_total, time.time() - start_time)
+        return best_matches, max_confidence
+    
+    def _select_matches(self, candidate_boxes: List[np.ndarray], candidate_scores: List[np.ndarray]) -> Tuple[List[Tuple[int, int, int, int, float]], float]:
+        """Remove overlapping candidates of one template (Non-Maximum Suppression)."""
+        if not candidate_boxes:
+            self.metrics.record('nms', 0.0)
+            return [], 0
+        boxes = np.concatenate(candidate_boxes)
+        scores = np.concatenate(candidate_scores)
+        keep = self._non_max_suppression(boxes, scores)
+        best_matches = [(int(x), int(y), int(w), int(h), float(score)) for (x, y, w, h), score in zip(boxes[keep], scores[keep])]
+        return best_matches, float(scores.max())
+    
+    def _record_match(self, cv2_match_time: float, preprocessing_time: float, match_time: float) -> None:
+        # Record detailed timings
+        self.metrics.record('cv2_template_match', cv2_match_time)
+        self.metrics.record('preprocessing', preprocessing_time)
+        self.metrics.record('template_match', match_time)
+        
+        # Print real-time metrics for this template match
+        self._log(2, f"    ⏱️  CV2 match: {cv2_match_time:.4f}s, Preprocessing: {preprocessing_time:.4f}s, NMS: {self.metrics.last('nms'):.4f}s, Total: {match_time:.4f}s")
+    
+    def _layout_correlator(self, image: np.ndarray) -> FFTCorrelator:
+        # The layout's transform is computed once and reused for every template and scale
+        if self._correlator is None or self._correlator[0] is not image:
+            self._correlator = (image, FFTCorrelator(image))
+        return self._correlator[1]
+    
+    def _coarse_candidate_regions(self, image: np.ndarray, template: np.ndarray) -> Tuple[Optional[List[Tuple[int, int, int, int]]], float, float]:
+        """
+        Match a downsampled template against the downsampled layout and turn the
+        candidates into disjoint regions of full-resolution match positions.
+        
+        Returns:
+            List of (x0, y0, x1, y1) position ranges (end exclusive), or None when the
+            template is too small to search coarsely, plus the cv2 match and
+            preprocessing times spent
+        """
+        preprocess_start = time.time()
+        factor = self.coarse_factor
+        template_h, template_w = template.shape[:2]
+        coarse_w, coarse_h = int(template_w * factor), int(template_h * factor)
+        if min(coarse_w, coarse_h) < self.min_coarse_size:
+            return None, 0.0, time.time() - preprocess_start
+        
+        # The layout is downsampled once and reused for every template and scale
+        if self._coarse_layout is None or self._coarse_layout[0] is not image:
+            coarse_image = cv2.resize(image, None, fx=factor, fy=factor, interpolation=cv2.INTER_AREA)
+            self._coarse_layout = (image, coarse_image)
+        coarse_image = self._coarse_layout[1]
+        if coarse_w > coarse_image.shape[1] or coarse_h > coarse_image.shape[0]:
+            return None, 0.0, time.time() - preprocess_start
+        coarse_template = cv2.resize(template, (coarse_w, coarse_h), interpolation=cv2.INTER_AREA)
+        preprocessing_time = time.time() - preprocess_start
+        
+        cv2_match_start = time.time()
+        coarse_result = cv2.matchTemplate(coarse_image, coarse_template, self.method)
+        cv2_match_time = time.time() - cv2_match_start
+        
+        candidates = (coarse_result >= self.threshold - self.coarse_margin).astype(np.uint8)
+        if not candidates.any():
+            return [], cv2_match_time, preprocessing_time
+        
+        # Project the candidate mask onto the full-resolution position grid, grown
+        # by the padding plus one coarse pixel of quantisation error, and search
+        # the bounding box of each connected group of candidates
+        result_h, result_w = image.shape[0] - template_h + 1, image.shape[1] - template_w + 1
+        mask = cv2.resize(candidates, (result_w, result_h), interpolation=cv2.INTER_NEAREST)
+        grow = self.roi_padding + int(np.ceil(1 / factor))
+        mask = cv2.dilate(mask, np.ones((2 * grow + 1, 2 * grow + 1), dtype=np.uint8))
+        count, _, stats, _ = cv2.connectedComponentsWithStats(mask, connectivity=8)
+        
+        regions = [(int(x), int(y), int(x + w), int(y + h)) for x, y, w, h, _ in stats[1:count]]
+        return regions, cv2_match_time, preprocessing_time
+    
+    def _non_max_suppression(self, boxes: np.ndarray, scores: np.ndarray, overlap_thresh: float = 0.8) -> np.ndarray:
+        """
+        Apply non-maximum suppression to remove overlapping matches.
+        
+        Returns:
+            Indices of the kept boxes, highest confidence first
+        """
+        nms_start = time.time()
+        keep = non_max_suppression(boxes, scores, overlap_thresh)
+        nms_time = time.time() - nms_start
+        self.metrics.record('nms', nms_time)
+        return keep
+    
+    def _match_elements(self, layout_gray: np.ndarray, template_bank: TemplateBank, element_names: List[str],
+                        element_matches: Dict[str, List[Tuple[int, int, int, int, float]]]) -> None:
+        if self.match_backend == 'fft' and self.search_mode == 'exhaustive':
+            self._match_elements_batched(layout_gray, template_bank, element_names, element_matches)
+            return
+        for element_name in element_names:
+            # Perform multi-scale template matching
+            matches, max_confidence = self.multi_scale_template_match(
+                layout_gray, template_bank.template(element_name), template_bank.scaled_templates(element_name))
+            self._add_element_matches(element_name, matches, max_confidence, element_matches)
+    
+    def _add_element_matches(self, element_name: str, matches: List[Tuple[int, int, int, int, float]], max_confidence: float,
+                             element_matches: Dict[str, List[Tuple[int, int, int, int, float]]]) -> None:
+        if matches:
+            self._log(1, f"  Found {len(matches)} matches for {element_name} (max confidence: {max_confidence:.3f})")
+            element_matches[element_name] = matches
+        
+        self.metrics.increment('total_templates_processed')
+    
+    def _match_elements_batched(self, layout_gray: np.ndarray, template_bank: TemplateBank, element_names: List[str],
+                                element_matches: Dict[str, List[Tuple[int, int, int, int, float]]]) -> None:
+        """
+        FFT backend, exhaustive search: correlate the scaled templates of all
+        elements against the layout together, so templates of the same padded
+        size share one batched transform whichever element they belong to.
+        Each batch's score maps are reduced to peaks before the next batch is
+        computed. A batch's correlation time is split evenly over its templates
+        in the per-element timings.
+        """
+        preprocess_start = time.time()
+        owners = []
+        templates = []
+        for i, element_name in enumerate(element_names):
+            for _, scaled_template in template_bank.scaled_templates(element_name):
+                if (scaled_template is not None and scaled_template.shape[0] <= layout_gray.shape[0]
+                        and scaled_template.shape[1] <= layout_gray.shape[1]):
+                    owners.append(i)
+                    templates.append(scaled_template)
+        preprocessing_time = (time.time() - preprocess_start) / max(1, len(element_names))
+        
+        candidate_boxes = [[] for _ in element_names]
+        candidate_scores = [[] for _ in element_names]
+        match_times = [0.0] * len(element_names)
+        batch_start = time.time()
+        for batch, results in self._layout_correlator(layout_gray).iter_batches(templates):
+            share = (time.time() - batch_start) / len(batch)
+            for k, result in zip(batch, results):
+                owner = owners[k]
+                match_times[owner] += share
+                ys, xs = np.nonzero(extract_peaks(result, self.threshold))
+                if len(xs) == 0:
+                    continue
+                scaled_h, scaled_w = templates[k].shape[:2]
+                candidate_boxes[owner].append(np.column_stack((xs, ys, np.full(len(xs), scaled_w), np.full(len(xs), scaled_h))))
+                candidate_scores[owner].append(result[ys, xs])
+            batch_start = time.time()
+        
+        for i, element_name in enumerate(element_names):
+            nms_start = time.time()
+            matches, max_confidence = self._select_matches(candidate_boxes[i], candidate_scores[i])
+            self._record_match(match_times[i], preprocessing_time,
+                               match_times[i] + preprocessing_time + time.time() - nms_start)
+            self._add_element_matches(element_name, matches, max_confidence, element_matches)
+    
+    def _suppress_across_elements(self, element_matches: Dict[str, List[Tuple[int, int, int, int, float]]]) -> Dict[str, List[Tuple[int, int, int, int, float]]]:
+        """
+        Run NMS over the matches of all elements in a layout, so each region keeps
+        only its most confident element.
+        """
+        names = list(element_matches)
+        flat = [(name, match) for name in names for match in element_matches[name]]
+        boxes = np.array([match[:4] for _, match in flat])
+        scores = np.array([match[4] for _, match in flat])
+        keep = self._non_max_suppression(boxes, scores)
+        
+        kept = {name: [] for name in names}
+        for i in sorted(keep):
+            name, match = flat[i]
+            kept[name].append(match)
+        self._log(1, f"  Cross-element NMS kept {len(keep)} of {len(flat)} matches")
+        return {name: matches for name, matches in kept.items() if matches}
+    
+    def highlight_matches(self, image: np.ndarray, matches: List[Tuple[int, int, int, int, float]], color: Optional[Tuple[int, int, int]] = None,
+                          element_name: str = "", in_place: bool = False) -> np.ndarray:
+        """
+        Draw bounding boxes around matches on the image, or on a copy of it
+        unless in_place is set.
+        """
+        highlight_start = time.time()
+        
+        if color is None:
+            color = (0, 255, 0)  # Green by default
+        
+        highlighted_image = image if in_place else image.copy()
+        
+        for match in matches:
+            x, y, w, h, confidence = match
+            cv2.rectangle(highlighted_image, (x, y), (x + w, y + h), color, 2)
+            
+            # Clean up element name (remove .png extension)
+            clean_name = element_name.replace('.png', '').replace('_', ' ')
+            
+            # Add element name and confidence text
+            label = f'{clean_name} ({confidence:.2f})'
+            
+            # Calculate text size to position it properly
+            font_scale = 0.5
+            thickness = 1
+            (text_width, text_height), baseline = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, font_scale, thickness)
+            
+            # Position text above the bounding box, but adjust if it goes off screen
+            text_y = y - 10
+            if text_y < text_height:
+                text_y = y + h + text_height + 5
+            
+            # Add a semi-transparent background for better readability
+            cv2.rectangle(highlighted_image, 
+                         (x, text_y - text_height - 5), 
+                         (x + text_width + 5, text_y + baseline),
+                         (0, 0, 0), -1)  # Black background
+            
+            cv2.putText(highlighted_image, label, 
+                       (x + 2, text_y - 2), cv2.FONT_HERSHEY_SIMPLEX, font_scale, color, thickness)
+        
+        highlight_time = time.time() - highlight_start
+        self.metrics.record('highlight', highlight_time)
+        
+        return highlighted_image
+    
+    def process_layouts(self, layouts_dirs: List[str], elements_dir: str, output_dir: str,
+                        template_bank: Optional[TemplateBank] = None, cache_dir: Optional[str] = None,
+                        workers: int = 1, plan: Optional[PlanIndex] = None, plan_fallback: bool = False,
+                        writer: Optional[OutputWriter] = None) -> MetricsRecorder:
+        """
+        Process all layout images from multiple directories against all element templates.
+        
+        Args:
+            layouts_dirs: Directories of layout screenshots
+            elements_dir: Directory of element templates
+            output_dir: Directory for highlighted layouts
+            template_bank: Preloaded templates to reuse; built from elements_dir when omitted
+            cache_dir: Directory for the template bank's persistent cache, if any
+            workers: Number of processes to spread layouts over (1 = serial)
+            plan: Optional plan index; layouts it knows are only matched against
+                their page's expected elements
+            plan_fallback: Sweep the remaining elements over a layout when one of
+                its expected elements is not found
+            writer: Output format and background writer settings (default:
+                PNGs written on two background threads); closed when the run ends
+        """
+        if writer is None:
+            writer = OutputWriter()
+        self.metrics.values['output_format'] = writer.output_format
+        os.makedirs(output_dir, exist_ok=True)
+        # Get all layout files from all directories
+        layout_files = []
+        for layouts_dir in layouts_dirs:
+            dir_files = sorted(glob.glob(os.path.join(layouts_dir, "*.png")))
+            for file_path in dir_files:
+                # Store both the file path and the source directory
+                layout_files.append((file_path, os.path.basename(layouts_dir)))
+        
+        element_files = sorted(glob.glob(os.path.join(elements_dir, "*.png")))
+        
+        # Load, grayscale and pre-scale every template once for all layouts
+        if template_bank is None:
+            template_bank = TemplateBank.from_files(element_files, self.scales, cache_dir)
+        elif template_bank.scales != self.scales:
+            raise ValueError(f"Template bank scales {template_bank.scales} do not match matcher scales {self.scales}")
+        self.metrics.values['template_bank_load_time'] = template_bank.load_time
+        source = "memory-mapped cache" if template_bank.from_cache else "image files"
+        print(f"📚 Template bank ready: {len(template_bank)} templates x {len(self.scales)} scales, "
+              f"{template_bank.nbytes() / 1024:.0f} KB from {source} in {template_bank.load_time:.4f}s")
+        
+        print(f"Found {len(layout_files)} layout images from {len(layouts_dirs)} directories and {len(template_bank)} element templates")
+        for i, layouts_dir in enumerate(layouts_dirs):
+            dir_count = len(glob.glob(os.path.join(layouts_dir, "*.png")))
+            print(f"  Directory {i+1}: {layouts_dir} ({dir_count} images)")
+        
+        # Restrict each layout to the elements the plan expects on its page
+        expected_elements = []
+        for layout_file, _ in layout_files:
+            groups = plan.expected_groups(layout_file) if plan is not None else None
+            if groups is not None:
+                groups = [[name for name in group if name in template_bank] for group in groups]
+                groups = [group for group in groups if group]
+            expected_elements.append(groups)
+        
+        total_operations = sum(len(template_bank) if groups is None else len({name for group in groups for name in group})
+                               for groups in expected_elements)
+        print(f"📈 Total template matching operations to perform: {total_operations}")
+        if plan is not None:
+            planned_layouts = sum(expected is not None for expected in expected_elements)
+            print(f"🗺️  Plan covers {planned_layouts} of {len(layout_files)} layouts; "
+                  f"{len(layout_files) * len(template_bank) - total_operations} matching operations pruned"
+                  f"{' (before fallback sweeps)' if plan_fallback else ''}")
+        if self.verbosity >= 2:
+            print(f"🎯 Real-time metrics will be displayed for each operation...")
+        print()
+        
+        if workers > 1 and len(layout_files) > 1:
+            writer.close()
+            self._process_layouts_parallel(layout_files, template_bank, output_dir, workers,
+                                           expected_elements, plan_fallback, writer.config())
+        else:
+            try:
+                for (layout_file, source_dir), expected in zip(layout_files, expected_elements):
+                    self.process_layout(layout_file, source_dir, template_bank, output_dir, expected, plan_fallback, writer)
+                    self._report_progress(len(layout_files))
+            finally:
+                writer.close()
+            writer.collect(self.metrics)
+        
+        return self.metrics
+    
+    def _process_layouts_parallel(self, layout_files: List[Tuple[str, str]], template_bank: TemplateBank,
+                                  output_dir: str, workers: int, expected_elements: List[Optional[List[List[str]]]],
+                                  plan_fallback: bool, writer_config: Dict[str, Any]) -> None:
+        """
+        Spread layouts over a process pool. Workers memory-map the given template
+        bank from its cache files (a bank built without a cache is saved to a
+        temporary directory first) instead of each rebuilding it, pin OpenCV to
+        a share of the cores, and return their metrics and log output, which are
+        merged and printed in layout order. Each worker writes its outputs on its
+        own OutputWriter, drained when the pool is closed; writes still running
+        when a worker reports its last layout are not in the 'file_write' stage.
+        """
+        temp_cache_dir = None
+        bank_paths = template_bank.cache_paths
+        if bank_paths is None:
+            # Workers share the templates through the bank's cache files
+            temp_cache_dir = tempfile.mkdtemp(prefix="template_bank_")
+            bank_paths = (os.path.join(temp_cache_dir, "template_bank.npy"),
+                          os.path.join(temp_cache_dir, "template_bank.json"))
+            template_bank.save(bank_paths)
+        
+        workers = min(workers, len(layout_files))
+        self.metrics.values['parallel_workers'] = workers
+        cv2_threads = max(1, (os.cpu_count() or 1) // workers)
+        print(f"⚙️  Processing {len(layout_files)} layouts on {workers} worker processes ({cv2_threads} OpenCV threads each)")
+        
+        try:
+            with mp.get_context().Pool(workers, initializer=_init_layout_worker,
+                                       initargs=(self.config(), writer_config, bank_paths, cv2_threads)) as pool:
+                tasks = [(layout_file, source_dir, output_dir, expected, plan_fallback)
+                         for (layout_file, source_dir), expected in zip(layout_files, expected_elements)]
+                for worker_metrics, output in pool.imap(_process_layout_in_worker, tasks):
+                    self.metrics.merge(worker_metrics)
+                    print(output, end="")
+                    self._report_progress(len(layout_files))
+                # Let workers exit normally so their pending writes finish (leaving
+                # the with block would terminate them)
+                pool.close()
+                pool.join()
+        finally:
+            if temp_cache_dir:
+                shutil.rmtree(temp_cache_dir, ignore_errors=True)
+    
+    def process_layout(self, layout_file: str, source_dir: str, template_bank: TemplateBank, output_dir: str,
+                       expected_elements: Optional[List[List[str]]] = None, fallback: bool = False,
+                       writer: Optional[OutputWriter] = None) -> int:
+        """
+        Match every template in the bank against one layout and save the highlighted layout
+        (or its detections).
+        
+        Args:
+            expected_elements: Only match these templates, given as groups of alternatives
+                (e.g. PlanIndex.expected_groups); all templates when omitted
+            fallback: Match the remaining templates too if no template of an expected group is found
+            writer: Where and how to save the output; a synchronous PNG writer when omitted
+        
+        Returns:
+            Number of matches found in the layout
+        """
+        layout_start_time = time.time()
+        layout_name = os.path.basename(layout_file)
+        
+        self._log(1, f"\nProcessing layout: {layout_name} (from {source_dir})")
+        
+        if writer is None:
+            writer = OutputWriter(threads=0)
+        
+        # Load layout image
+        load_start = time.time()
+        layout_image = cv2.imread(layout_file)
+        if layout_image is None:
+            print(f"Could not load layout image: {layout_file}")
+            return 0
+        
+        layout_gray = cv2.cvtColor(layout_image, cv2.COLOR_BGR2GRAY)
+        load_time = time.time() - load_start
+        self.metrics.record('image_load', load_time)
+        self._log(2, f"  🖼️  Layout image loaded: {load_time:.4f}s")
+        
+        layout_matches_found = 0
+        element_matches = {}
+        
+        if expected_elements is None:
+            candidates = template_bank.names
+        else:
+            expected = {name for group in expected_elements for name in group}
+            candidates = [name for name in template_bank.names if name in expected]
+        skipped = [name for name in template_bank.names if name not in set(candidates)]
+        
+        # Process each element template
+        self._match_elements(layout_gray, template_bank, candidates, element_matches)
+        
+        if skipped:
+            missing = [group for group in expected_elements if not any(name in element_matches for name in group)]
+            if fallback and missing:
+                self._log(1, f"  🔁 {len(missing)} expected elements not found ({', '.join('/'.join(group) for group in missing)}); "
+                             f"sweeping {len(skipped)} other elements")
+                self._match_elements(layout_gray, template_bank, skipped, element_matches)
+                self.metrics.increment('fallback_template_matches', len(skipped))
+            else:
+                self._log(1, f"  🗺️  Skipped {len(skipped)} elements not expected on this page")
+                self.metrics.increment('skipped_template_matches', len(skipped))
+        
+        if self.nms_scope == 'layout' and element_matches:
+            element_matches = self._suppress_across_elements(element_matches)
+        
+        for element_name, matches in element_matches.items():
+            if writer.draws_images:
+                # Generate a unique color for this element
+                color = self._generate_color_for_element(element_name)
+                
+                # Highlight matches with element name, drawing on the loaded layout itself
+                self.highlight_matches(layout_image, matches, color, element_name, in_place=True)
+                self._log(2, f"    🎨 Highlighting {element_name} completed: {self.metrics.last('highlight'):.4f}s")
+            layout_matches_found += len(matches)
+            self.metrics.increment('total_matches_found', len(matches))
+        
+        # Save the output with source directory prefix; file_save is the time
+        # the layout waits for the writer, not the (background) encode
+        os.makedirs(output_dir, exist_ok=True)
+        output_path = writer.output_path(output_dir, layout_name, source_dir)
+        detections = {
+            'layout': f"{source_dir}/{layout_name}",
+            'width': layout_image.shape[1],
+            'height': layout_image.shape[0],
+            'elements': {name: [{'x': x, 'y': y, 'width': w, 'height': h, 'confidence': score}
+                                for x, y, w, h, score in matches]
+                         for name, matches in element_matches.items()}
+        }
+        
+        save_start = time.time()
+        writer.submit(output_path, layout_image, detections)
+        save_time = time.time() - save_start
+        self.metrics.record('file_save', save_time)
+        self._log(2, f"  💾 File queued: {save_time:.4f}s")
+        
+        layout_processing_time = time.time() - layout_start_time
+        layout_key = f"{source_dir}/{layout_name}"
+        self.metrics.layout_processing_times[layout_key] = layout_processing_time
+        
+        self._log(1, f"  Layout processing complete: {layout_matches_found} total matches found")
+        self._log(1, f"  Processing time: {layout_processing_time:.3f} seconds")
+        self._log(1, f"  Saved output: {output_path}")
+        
+        return layout_matches_found
+    
+    def _report_progress(self, total_layouts: int) -> None:
+        """
+        Print running averages every report_interval layouts, from the
+        streaming statistics rather than the full timing history.
+        """
+        done = len(self.metrics.layout_processing_times)
+        if self.verbosity < 1 or not self.report_interval or (done % self.report_interval and done != total_layouts):
+            return
+        stages = self.metrics.stages
+        print(f"  📊 Running averages after {done}/{total_layouts} layouts:")
+        print(f"    • CV2 template matching: {stages['cv2_template_match'].mean():.4f}s")
+        print(f"    • Non-max suppression: {stages['nms'].mean():.4f}s")
+        print(f"    • Image loading: {stages['image_load'].mean():.4f}s")
+        print(f"    • Highlighting: {stages['highlight'].mean():.4f}s")
+        print(f"    • File saving: {stages['file_save'].mean():.4f}s")
+        print(f"    • Background writing: {stages['file_write'].mean():.4f}s")
+    
+    def _generate_color_for_element(self, element_name: str) -> Tuple[int, int, int]:
+        """
+        Generate a consistent color for each element type.
+        """
+        # Create a hash-based color (crc32 is stable across processes, unlike hash())
+        hash_value = zlib.crc32(element_name.encode())
+        r = (hash_value & 0xFF0000) >> 16
+        g = (hash_value & 0x00FF00) >> 8
+        b = hash_value & 0x0000FF
+        
+        # Ensure colors are bright enough
+        r = max(r, 100)
+        g = max(g, 100)
+        b = max(b, 100)
+        
+        return (b, g, r)  # BGR format for OpenCV
+    
+    def save_metrics(self, output_file: str, csv_file: Optional[str] = None) -> None:
+        """
+        Save metrics to a JSON file, and per-stage statistics to a CSV file if given.
+        """
+        summary_metrics = self.metrics.summary()
+        # A one-off timing, reported with the per-stage totals
+        summary_metrics['summary']['total_template_bank_load_time_seconds'] = self.metrics.values.get('template_bank_load_time', 0)
+        summary_metrics['configuration'] = {
+            'parallel_workers': self.metrics.values.get('parallel_workers', 1),
+            'output_format': self.metrics.values.get('output_format', 'png'),
+            'search_mode': self.search_mode,
+            'match_backend': self.match_backend,
+            'match_method': self.method,
+            'scales_used': self.scales,
+            'confidence_threshold': self.threshold
+        }
+        
+        with open(output_file, 'w') as f:
+            json.dump(summary_metrics, f, indent=2)
+        
+        print(f"\nMetrics saved to: {output_file}")
+        if csv_file:
+            self.metrics.write_csv(csv_file)
+            print(f"Stage statistics saved to: {csv_file}")
+        
+        # Print detailed timing breakdown
+        print("\nDetailed Timing Breakdown:")
+        print("-" * 50)
+        for line in self.metrics.report():
+            print(line)
+        
+        # Calculate percentages
+        stages = self.metrics.stages
+        stage_totals = {stage: stages[stage].sum for stage in ('template_match', 'image_load', 'highlight', 'file_save')}
+        total_time = sum(stage_totals.values())
+        if total_time > 0:
+            print(f"\nTime Distribution:")
+            print(f"Template Matching: {(stage_totals['template_match']/total_time)*100:.1f}%")
+            print(f"Image Loading:     {(stage_totals['image_load']/total_time)*100:.1f}%")
+            print(f"Highlighting:      {(stage_totals['highlight']/total_time)*100:.1f}%")
+            print(f"File Saving:       {(stage_totals['file_save']/total_time)*100:.1f}%")
+
+def extract_peaks(result: np.ndarray, threshold: float) -> np.ndarray:
+    """
+    Mask of positions in a matchTemplate score map that reach the threshold and
+    are maxima of their 3x3 neighbourhood.
+    """
+    neighbourhood_max = cv2.dilate(result, np.ones((3, 3), dtype=np.uint8))
+    return (result >= threshold) & (result >= neighbourhood_max)
+
+def non_max_suppression(boxes: np.ndarray, scores: np.ndarray, overlap_thresh: float = 0.8) -> np.ndarray:
+    """
+    Greedy non-maximum suppression over (x, y, w, h) boxes.
+    
+    Args:
+        boxes: (N, 4) array of x, y, width, height
+        scores: (N,) confidences
+        overlap_thresh: Boxes overlapping a kept box by more than this IoU are dropped
+    
+    Returns:
+        Indices of the kept boxes, highest score first
+    """
+    if len(boxes) == 0:
+        return np.empty(0, dtype=np.int64)
+    
+    boxes = np.asarray(boxes, dtype=np.float64)
+    x1 = boxes[:, 0]
+    y1 = boxes[:, 1]
+    x2 = x1 + boxes[:, 2]
+    y2 = y1 + boxes[:, 3]
+    areas = boxes[:, 2] * boxes[:, 3]
+    
+    order = np.argsort(-np.asarray(scores), kind='stable')
+    keep = []
+    while order.size > 0:
+        i = order[0]
+        keep.append(i)
+        rest = order[1:]
+        inter_w = np.clip(np.minimum(x2[i], x2[rest]) - np.maximum(x1[i], x1[rest]), 0, None)
+        inter_h = np.clip(np.minimum(y2[i], y2[rest]) - np.maximum(y1[i], y1[rest]), 0, None)
+        inter = inter_w * inter_h
+        iou = inter / (areas[i] + areas[rest] - inter)
+        order = rest[iou <= overlap_thresh]
+    return np.array(keep, dtype=np.int64)
+
+_worker_state: Dict[str, Any] = {}
+
+def _init_layout_worker(matcher_config: Dict[str, Any], writer_config: Dict[str, Any], bank_paths: Tuple[str, str],
+                        cv2_threads: int) -> None:
+    cv2.setNumThreads(cv2_threads)
+    _worker_state['matcher'] = MultiScaleTemplateMatcher(**matcher_config)
+    writer = _worker_state['writer'] = OutputWriter(**writer_config)
+    # Runs when the pool is closed and the worker exits normally
+    mp_util.Finalize(writer, writer.close, exitpriority=10)
+    _worker_state['template_bank'] = TemplateBank.load(bank_paths)
+
+def _process_layout_in_worker(task: Tuple[str, str, str, Optional[List[List[str]]], bool]) -> Tuple[MetricsRecorder, str]:
+    layout_file, source_dir, output_dir, expected_elements, fallback = task
+    matcher = _worker_state['matcher']
+    matcher.metrics = MetricsRecorder(matcher.keep_samples)
+    output = io.StringIO()
+    with redirect_stdout(output):
+        matcher.process_layout(layout_file, source_dir, _worker_state['template_bank'], output_dir, expected_elements, fallback,
+                               _worker_state['writer'])
+    _worker_state['writer'].collect(matcher.metrics)
+    return matcher.metrics, output.getvalue()
@@ -0,0 +1,184 @@
+import csv
+import math
+import numpy as np
+from typing import Any, Dict, List, Optional
+
+
+class StreamingHistogram:
+    """
+    Fixed-memory summary of a stream of durations: count, sum, min, max and
+    log-spaced bucket counts for approximate quantiles.
+
+    Buckets grow by 2 ** (1 / 8) (about 9% apart) from 1 microsecond to about
+    3 hours, so quantiles are within half a bucket (about 4.5%) of the true
+    value, clamped to the observed min and max. Shorter durations, including
+    zero, share the first bucket.
+    """
+
+    MIN_VALUE = 1e-6
+    BUCKETS_PER_OCTAVE = 8
+    NUM_BUCKETS = 8 * 34
+
+    def __init__(self):
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        self.buckets = np.zeros(self.NUM_BUCKETS, dtype=np.int64)
+
+    def _bucket(self, value: float) -> int:
+        if value <= self.MIN_VALUE:
+            return 0
+        index = int(math.log2(value / self.MIN_VALUE) * self.BUCKETS_PER_OCTAVE) + 1
+        return min(index, self.NUM_BUCKETS - 1)
+
+    def add(self, value: float) -> None:
+        self.count += 1
+        self.sum += value
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+        self.buckets[self._bucket(value)] += 1
+
+    def merge(self, other: 'StreamingHistogram') -> None:
+        self.count += other.count
+        self.sum += other.sum
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self.buckets += other.buckets
+
+    def mean(self) -> float:
+        return self.sum / self.count if self.count else 0.0
+
+    def quantile(self, q: float) -> float:
+        if not self.count:
+            return 0.0
+        index = int(np.searchsorted(np.cumsum(self.buckets), q * self.count))
+        index = min(index, self.NUM_BUCKETS - 1)
+        if index == 0:
+            estimate = self.MIN_VALUE
+        else:
+            # Geometric midpoint of the bucket
+            estimate = self.MIN_VALUE * 2 ** ((index - 0.5) / self.BUCKETS_PER_OCTAVE)
+        return min(max(estimate, self.min), self.max)
+
+    def to_dict(self) -> Dict[str, float]:
+        return {
+            'count': self.count,
+            'sum_seconds': self.sum,
+            'mean_seconds': self.mean(),
+            'min_seconds': self.min if self.count else 0.0,
+            'max_seconds': self.max if self.count else 0.0,
+            'p50_seconds': self.quantile(0.5),
+            'p90_seconds': self.quantile(0.9),
+            'p99_seconds': self.quantile(0.99)
+        }
+
+
+class MetricsRecorder:
+    """
+    Stage timings and counters of a template matching run.
+
+    Each stage keeps a StreamingHistogram, so memory does not grow with the
+    number of operations. Raw per-operation samples are only kept with
+    `keep_samples=True`, for the `individual_*` lists of the old metrics.json.
+    """
+
+    # Stage name -> label used in reports, in metrics.json order
+    STAGES = {
+        'template_match': 'Overall Template Match',
+        'cv2_template_match': 'CV2 Template Matching',
+        'nms': 'Non-Max Suppression',
+        'image_load': 'Image Loading',
+        'highlight': 'Highlighting',
+        'file_save': 'File Saving',
+        'file_write': 'Background Writing',
+        'preprocessing': 'Preprocessing'
+    }
+    REPORT_ORDER = ('cv2_template_match', 'nms', 'image_load', 'preprocessing', 'highlight', 'file_save', 'file_write',
+                    'template_match')
+    COUNTERS = ('total_matches_found', 'total_templates_processed',
+                'skipped_template_matches', 'fallback_template_matches')
+
+    def __init__(self, keep_samples: bool = False):
+        self.keep_samples = keep_samples
+        self.stages = {stage: StreamingHistogram() for stage in self.STAGES}
+        self.samples: Dict[str, List[float]] = {stage: [] for stage in self.STAGES} if keep_samples else {}
+        self.counters: Dict[str, int] = {name: 0 for name in self.COUNTERS}
+        self.layout_processing_times: Dict[str, float] = {}
+        self.values: Dict[str, Any] = {}
+        self._last: Dict[str, float] = {}
+
+    def record(self, stage: str, seconds: float) -> None:
+        self.stages[stage].add(seconds)
+        self._last[stage] = seconds
+        if self.keep_samples:
+            self.samples[stage].append(seconds)
+
+    def last(self, stage: str) -> float:
+        """Most recent value recorded for a stage."""
+        return self._last.get(stage, 0.0)
+
+    def increment(self, counter: str, amount: int = 1) -> None:
+        self.counters[counter] = self.counters.get(counter, 0) + amount
+
+    def merge(self, other: 'MetricsRecorder') -> None:
+        """Fold metrics recorded elsewhere (e.g. in a worker process) into this recorder."""
+        for stage, histogram in other.stages.items():
+            self.stages[stage].merge(histogram)
+        for stage, samples in other.samples.items():
+            self.samples.setdefault(stage, []).extend(samples)
+        for counter, value in other.counters.items():
+            self.increment(counter, value)
+        self.layout_processing_times.update(other.layout_processing_times)
+        self._last.update(other._last)
+
+    def summary(self) -> Dict[str, Any]:
+        """
+        The 'summary' and 'detailed_metrics' sections of metrics.json.
+        """
+        summary = {
+            'total_layouts_processed': len(self.layout_processing_times),
+            'total_templates_processed': self.counters['total_templates_processed'],
+            'total_matches_found': self.counters['total_matches_found'],
+            'total_template_matches_performed': self.stages['template_match'].count,
+            'skipped_template_matches': self.counters['skipped_template_matches'],
+            'fallback_template_matches': self.counters['fallback_template_matches']
+        }
+        for stage, histogram in self.stages.items():
+            summary[f'average_{stage}_time_seconds'] = histogram.mean()
+        for stage, histogram in self.stages.items():
+            if stage != 'template_match':
+                summary[f'total_{stage}_time_seconds'] = histogram.sum
+        for stage, histogram in self.stages.items():
+            if stage != 'template_match':
+                summary[f'{stage.replace("_template_match", "")}_operations_count'] = histogram.count
+
+        detailed = {
+            'layout_processing_times_seconds': self.layout_processing_times,
+            'stage_statistics': {stage: histogram.to_dict() for stage, histogram in self.stages.items()}
+        }
+        for stage, samples in self.samples.items():
+            detailed[f'individual_{stage}_times_seconds'] = samples
+        return {'summary': summary, 'detailed_metrics': detailed}
+
+    def write_csv(self, output_file: str) -> None:
+        """Write one row of statistics per stage."""
+        fields = ['stage', 'count', 'sum_seconds', 'mean_seconds', 'min_seconds', 'max_seconds',
+                  'p50_seconds', 'p90_seconds', 'p99_seconds']
+        with open(output_file, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=fields)
+            writer.writeheader()
+            for stage, histogram in self.stages.items():
+                writer.writerow({'stage': stage, **histogram.to_dict()})
+
+    def report(self, stages: Optional[List[str]] = None) -> List[str]:
+        """Lines of 'label: total, mean, p90 (count ops)' for the given stages."""
+        lines = []
+        for stage in stages or self.REPORT_ORDER:
+            histogram = self.stages[stage]
+            label = f"{self.STAGES[stage]}:"
+            lines.append(f"{label:<23}{histogram.sum:.3f}s total, {histogram.mean():.4f}s avg, "
+                         f"{histogram.quantile(0.9):.4f}s p90 ({histogram.count} ops)")
+        return lines
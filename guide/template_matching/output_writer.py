@@ -0,0 +1,132 @@
+import cv2
+import json
+import numpy as np
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+from metrics_recorder import MetricsRecorder, StreamingHistogram
+
+
+class OutputWriter:
+    """
+    Encodes and writes the per-layout outputs of process_layouts.
+
+    'png' and 'jpg' save the highlighted layout; 'boxes' saves only a JSON
+    file of the detections, so nothing is drawn or encoded. With `threads` > 0
+    encoding and writing run on a background thread pool (cv2.imencode
+    releases the GIL), and at most `max_pending` outputs are queued: submit
+    blocks once the queue is full, so a slow disk slows the run down instead
+    of holding every annotated layout in memory. With threads=0 every output
+    is written before submit returns.
+
+    The time submit blocks is the caller's to record; the background encode
+    and write time of finished outputs is kept here and moved into a
+    MetricsRecorder's 'file_write' stage by collect().
+    """
+
+    FORMATS = ('png', 'jpg', 'boxes')
+
+    def __init__(self, output_format: str = 'png', png_compression: Optional[int] = None, jpeg_quality: int = 90,
+                 threads: int = 2, max_pending: int = 8):
+        """
+        Args:
+            output_format: 'png', 'jpg' or 'boxes'
+            png_compression: zlib level 0-9 for PNGs (None keeps OpenCV's default)
+            jpeg_quality: JPEG quality 0-100
+            threads: Background writer threads (0 writes synchronously)
+            max_pending: Outputs that may be queued or being written at once
+        """
+        if output_format not in self.FORMATS:
+            raise ValueError(f"Unknown output format {output_format!r}, expected one of {self.FORMATS}")
+        self.output_format = output_format
+        self.png_compression = png_compression
+        self.jpeg_quality = jpeg_quality
+        self.threads = threads
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(threads, thread_name_prefix='output') if threads > 0 else None
+        self._slots = threading.BoundedSemaphore(max(1, max_pending))
+        self._futures: List[Future] = []
+        self._lock = threading.Lock()
+        self._write_times = StreamingHistogram()
+
+    def config(self) -> Dict[str, Any]:
+        """Constructor arguments that reproduce this writer (e.g. in a worker process)."""
+        return {
+            'output_format': self.output_format,
+            'png_compression': self.png_compression,
+            'jpeg_quality': self.jpeg_quality,
+            'threads': self.threads,
+            'max_pending': self.max_pending
+        }
+
+    @property
+    def draws_images(self) -> bool:
+        return self.output_format != 'boxes'
+
+    def output_path(self, output_dir: str, layout_name: str, source_dir: str) -> str:
+        stem = os.path.splitext(layout_name)[0]
+        if self.output_format == 'boxes':
+            return os.path.join(output_dir, f"detections_{source_dir}_{stem}.json")
+        return os.path.join(output_dir, f"highlighted_{source_dir}_{stem}.{self.output_format}")
+
+    def submit(self, path: str, image: Optional[np.ndarray], detections: Dict[str, Any]) -> None:
+        """
+        Queue one layout's output. The writer takes ownership of `image`; the
+        caller must not modify it afterwards.
+        """
+        payload = detections if self.output_format == 'boxes' else image
+        if self._executor is None:
+            self._write(path, payload)
+            return
+        # Surface a failed background write at the next submit rather than at the end of the run
+        with self._lock:
+            failed = [f for f in self._futures if f.done() and f.exception() is not None]
+            self._futures = [f for f in self._futures if not f.done()]
+        if failed:
+            raise failed[0].exception()
+        self._slots.acquire()
+        future = self._executor.submit(self._write, path, payload)
+        future.add_done_callback(lambda _: self._slots.release())
+        with self._lock:
+            self._futures.append(future)
+
+    def _write(self, path: str, payload: Any) -> None:
+        start_time = time.time()
+        if self.output_format == 'boxes':
+            with open(path, 'w') as f:
+                json.dump(payload, f)
+        else:
+            if self.output_format == 'jpg':
+                params = [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality]
+            elif self.png_compression is not None:
+                params = [cv2.IMWRITE_PNG_COMPRESSION, self.png_compression]
+            else:
+                params = []
+            ok, encoded = cv2.imencode(f'.{self.output_format}', payload, params)
+            if not ok:
+                raise IOError(f"Could not encode {path}")
+            with open(path, 'wb') as f:
+                f.write(encoded)
+        with self._lock:
+            self._write_times.add(time.time() - start_time)
+
+    def flush(self) -> None:
+        """Wait for every queued output; re-raises the first write error."""
+        with self._lock:
+            futures, self._futures = self._futures, []
+        for future in futures:
+            future.result()
+
+    def close(self) -> None:
+        self.flush()
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    def collect(self, recorder: MetricsRecorder) -> None:
+        """Move the timings of finished writes into the recorder's 'file_write' stage."""
+        with self._lock:
+            write_times, self._write_times = self._write_times, StreamingHistogram()
+        recorder.stages['file_write'].merge(write_times)
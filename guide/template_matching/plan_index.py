@@ -0,0 +1,97 @@
+import json
+import os
+from typing import Dict, List, Optional, Set, Tuple
+
+
+class PlanIndex:
+    """
+    Which element templates are expected on which layout screenshot, according
+    to a guide plan (`guide/plan.json`).
+
+    A page's expected elements are the `screenshot` and `open_screenshot`
+    templates of its elements plus the templates its steps click. The
+    templates of one element are alternatives (an element shows either its
+    closed or its open state), so they are kept together as a group. A layout
+    screenshot belongs to a page if it is the page's own screenshot or the
+    success screenshot of one of the page's steps. Screenshot paths in the plan
+    are relative to the plan file's directory; templates are identified by file
+    name, like in TemplateBank. `element_templates` maps each plan
+    `element_id` to its template group.
+    """
+
+    def __init__(self, page_elements: Dict[int, Set[Tuple[str, ...]]], layout_pages: Dict[str, Set[int]],
+                 element_templates: Optional[Dict[str, Tuple[str, ...]]] = None):
+        self.page_elements = page_elements
+        self.layout_pages = layout_pages
+        self.element_templates = element_templates or {}
+
+    @classmethod
+    def from_file(cls, plan_path: str) -> 'PlanIndex':
+        with open(plan_path, 'r') as f:
+            plan = json.load(f)
+        base_dir = os.path.dirname(os.path.abspath(plan_path))
+
+        page_elements: Dict[int, Set[Tuple[str, ...]]] = {}
+        layout_pages: Dict[str, Set[int]] = {}
+        element_templates: Dict[str, Tuple[str, ...]] = {}
+
+        def add_layout(screenshot: Optional[str], page_id: int) -> None:
+            if screenshot:
+                layout_pages.setdefault(cls._key(os.path.join(base_dir, screenshot)), set()).add(page_id)
+
+        for page in plan.get('pages', []):
+            page_id = page['page_id']
+            groups = page_elements.setdefault(page_id, set())
+            for element in page.get('elements', []):
+                group = tuple(os.path.basename(element[field]) for field in ('screenshot', 'open_screenshot') if element.get(field))
+                if group:
+                    groups.add(group)
+                    if element.get('element_id'):
+                        element_templates[element['element_id']] = group
+            add_layout(page.get('screenshot'), page_id)
+
+        for step in plan.get('steps', []):
+            page_id = step.get('page')
+            if page_id is None:
+                continue
+            machine_screenshot = step.get('machine', {}).get('screenshot')
+            if machine_screenshot:
+                page_elements.setdefault(page_id, set()).add((os.path.basename(machine_screenshot),))
+            add_layout(step.get('success', {}).get('screenshot'), page_id)
+
+        # A clicked template that already belongs to an element's group adds nothing
+        for page_id, groups in page_elements.items():
+            page_elements[page_id] = {group for group in groups
+                                      if len(group) > 1 or not any(group[0] in other for other in groups if other != group)}
+
+        return cls(page_elements, layout_pages, element_templates)
+
+    @staticmethod
+    def _key(path: str) -> str:
+        return os.path.normcase(os.path.realpath(path))
+
+    def expected_groups(self, layout_file: str) -> Optional[List[Tuple[str, ...]]]:
+        """
+        Return the alternative template groups expected on a layout, or None when
+        the plan does not mention the layout.
+        """
+        pages = self.layout_pages.get(self._key(layout_file))
+        if pages is None:
+            return None
+        groups: Set[Tuple[str, ...]] = set()
+        for page_id in pages:
+            groups |= self.page_elements.get(page_id, set())
+        return sorted(groups)
+
+    def expected_elements(self, layout_file: str) -> Optional[Set[str]]:
+        """
+        Return the template file names expected on a layout, or None when the
+        plan does not mention the layout.
+        """
+        groups = self.expected_groups(layout_file)
+        if groups is None:
+            return None
+        return {name for group in groups for name in group}
+
+    def pages(self, layout_file: str) -> List[int]:
+        return sorted(self.layout_pages.get(self._key(layout_file), ()))
@@ -0,0 +1,176 @@
+import cv2
+import numpy as np
+import hashlib
+import json
+import os
+import time
+from typing import List, Tuple, Optional
+
+
+class TemplateBank:
+    """
+    Element templates loaded, converted to grayscale and resized to every
+    configured scale exactly once, so matching a layout never decodes or
+    resizes a template again.
+
+    All images live in one flat uint8 buffer. `index[t, s]` holds the
+    (offset, height, width) of template `t` at slot `s`, where slot 0 is the
+    unscaled grayscale template and slot `i + 1` is `scales[i]`. Scales that
+    shrink a template to nothing are stored with height = width = 0.
+
+    With a `cache_dir`, the buffer is persisted as an .npy file named after a
+    hash of the template file contents and scales, and memory-mapped back on
+    later runs instead of being rebuilt. `cache_paths` holds the (.npy, .json)
+    files a bank was loaded from or saved to, so other processes can map the
+    same bank with `load`.
+    """
+
+    CACHE_VERSION = 1
+
+    def __init__(self, names: List[str], scales: List[float], buffer: np.ndarray, index: np.ndarray):
+        self.names = names
+        self.scales = list(scales)
+        self.buffer = buffer
+        self.index = index
+        self._positions = {name: i for i, name in enumerate(names)}
+        self.load_time = 0.0
+        self.from_cache = False
+        self.cache_paths: Optional[Tuple[str, str]] = None
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._positions
+
+    @classmethod
+    def from_files(cls, element_files: List[str], scales: List[float], cache_dir: Optional[str] = None) -> 'TemplateBank':
+        """
+        Build a bank from template image files, reusing the memory-mapped cache if it is current.
+
+        Args:
+            element_files: Template image paths; each is keyed by its file name
+            scales: Scale factors to pre-compute
+            cache_dir: Optional directory for the persistent cache
+
+        Returns:
+            The loaded TemplateBank
+        """
+        start_time = time.time()
+        cache_paths = None
+        if cache_dir:
+            key = cls._cache_key(element_files, scales)
+            cache_paths = (
+                os.path.join(cache_dir, f"template_bank_{key}.npy"),
+                os.path.join(cache_dir, f"template_bank_{key}.json")
+            )
+            if all(os.path.exists(path) for path in cache_paths):
+                return cls.load(cache_paths)
+
+        names = []
+        images = []
+        for element_file in element_files:
+            element_template = cv2.imread(element_file)
+            if element_template is None:
+                print(f"Could not load element template: {element_file}")
+                continue
+            element_gray = cv2.cvtColor(element_template, cv2.COLOR_BGR2GRAY)
+            names.append(os.path.basename(element_file))
+            images.append(cls._scale_pyramid(element_gray, scales))
+
+        index = np.zeros((len(names), len(scales) + 1, 3), dtype=np.int64)
+        offset = 0
+        for t, pyramid in enumerate(images):
+            for s, image in enumerate(pyramid):
+                if image is None:
+                    continue
+                index[t, s] = (offset, image.shape[0], image.shape[1])
+                offset += image.size
+
+        buffer = np.empty(offset, dtype=np.uint8)
+        for t, pyramid in enumerate(images):
+            for s, image in enumerate(pyramid):
+                if image is not None:
+                    start, h, w = index[t, s]
+                    buffer[start:start + h * w] = image.ravel()
+
+        bank = cls(names, scales, buffer, index)
+        if cache_paths:
+            bank.save(cache_paths)
+            bank.cache_paths = cache_paths
+        bank.load_time = time.time() - start_time
+        return bank
+
+    @classmethod
+    def load(cls, cache_paths: Tuple[str, str]) -> 'TemplateBank':
+        """
+        Memory-map a bank written by `save` (or cached by `from_files`).
+
+        Args:
+            cache_paths: The bank's (.npy buffer, .json index) files
+        """
+        start_time = time.time()
+        with open(cache_paths[1], 'r') as f:
+            meta = json.load(f)
+        bank = cls(meta['names'], meta['scales'],
+                   np.load(cache_paths[0], mmap_mode='r'),
+                   np.asarray(meta['index'], dtype=np.int64))
+        bank.load_time = time.time() - start_time
+        bank.from_cache = True
+        bank.cache_paths = tuple(cache_paths)
+        return bank
+
+    def save(self, cache_paths: Tuple[str, str]) -> None:
+        """Write the bank to (.npy buffer, .json index) files that `load` maps back."""
+        os.makedirs(os.path.dirname(cache_paths[0]) or '.', exist_ok=True)
+        # Write under temporary names and rename, so concurrent readers
+        # (pool workers, server processes) never map a half-written file;
+        # the .json is renamed last since its presence marks the cache done
+        suffix = f".{os.getpid()}.tmp"
+        with open(cache_paths[0] + suffix, 'wb') as f:
+            np.save(f, np.asarray(self.buffer))
+        with open(cache_paths[1] + suffix, 'w') as f:
+            json.dump({'names': self.names, 'scales': list(self.scales), 'index': self.index.tolist()}, f)
+        os.replace(cache_paths[0] + suffix, cache_paths[0])
+        os.replace(cache_paths[1] + suffix, cache_paths[1])
+
+    @staticmethod
+    def _scale_pyramid(template: np.ndarray, scales: List[float]) -> List[Optional[np.ndarray]]:
+        template_h, template_w = template.shape[:2]
+        pyramid = [template]
+        for scale in scales:
+            scaled_w = int(template_w * scale)
+            scaled_h = int(template_h * scale)
+            if scaled_w <= 0 or scaled_h <= 0:
+                pyramid.append(None)
+            else:
+                pyramid.append(cv2.resize(template, (scaled_w, scaled_h)))
+        return pyramid
+
+    @classmethod
+    def _cache_key(cls, element_files: List[str], scales: List[float]) -> str:
+        digest = hashlib.sha1()
+        digest.update(f"{cls.CACHE_VERSION}|{cv2.__version__}|{list(scales)}".encode())
+        for element_file in element_files:
+            digest.update(os.path.basename(element_file).encode())
+            with open(element_file, 'rb') as f:
+                digest.update(hashlib.sha1(f.read()).digest())
+        return digest.hexdigest()[:16]
+
+    def _view(self, position: int, slot: int) -> Optional[np.ndarray]:
+        start, h, w = self.index[position, slot]
+        if h == 0:
+            return None
+        return self.buffer[start:start + h * w].reshape(h, w)
+
+    def template(self, name: str) -> np.ndarray:
+        """Return the unscaled grayscale template."""
+        return self._view(self._positions[name], 0)
+
+    def scaled_templates(self, name: str) -> List[Tuple[float, Optional[np.ndarray]]]:
+        """Return (scale, scaled template) pairs in `scales` order; the template is None when it scales to nothing."""
+        position = self._positions[name]
+        return [(scale, self._view(position, s + 1)) for s, scale in enumerate(self.scales)]
+
+    def nbytes(self) -> int:
+        return int(self.buffer.nbytes)
@@ -0,0 +1,252 @@
+"""
+Load-testing and per-stage benchmark harness for the resource server.
+
+`load` drives a running server over HTTP with a configurable query mix and
+concurrency and reports throughput plus p50/p95/p99 request latency, and
+per-stage latency when the server is started with --server-timing:
+
+    python main.py --retrieval-backend bm25 --server-timing &
+    python bench_server.py load --url http://localhost:8000 --concurrency 8 --requests 500
+
+`stages` builds the components in-process (no server, no license needed
+with the bm25 backend) and times each stage of a /resources call over the
+same query mix:
+
+    python bench_server.py stages --retrieval-backend bm25 --requests 200
+
+`startup` launches main.py with the given server arguments several times
+and reports time-to-listen (first 200 from /health) and time-to-ready (first
+200 from /ready), stopping the server with SIGTERM after each run so it
+saves its expansion cache for the next:
+
+    python bench_server.py startup --runs 5 -- --retrieval-backend bm25 --fast-start
+"""
+
+import argparse
+import json
+import os
+import random
+import signal
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_QUERIES = [
+    "how do I report a noise complaint about my neighbor",
+    "banging or pounding noise at night",
+    "apply for food stamps snap benefits",
+    "renew a driver license online",
+    "heat or hot water not working in apartment",
+    "schedule bulk item trash pickup",
+    "property tax exemption for seniors",
+    "report a pothole on my street",
+    "rent increase rules for stabilized apartments",
+    "get a copy of a birth certificate",
+]
+
+def read_lines(path: str | None, default: list[str]) -> list[str]:
+    if not path:
+        return default
+    with open(path) as f:
+        return [line.strip() for line in f if line.strip()]
+
+def percentile(sorted_values: list[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+def summarize(name: str, seconds: list[float]) -> str:
+    values = sorted(seconds)
+    return (
+        f"{name:<22} n={len(values):<6} mean={statistics.fmean(values) * 1000:8.2f}ms "
+        f"p50={percentile(values, 0.50) * 1000:8.2f}ms p95={percentile(values, 0.95) * 1000:8.2f}ms "
+        f"p99={percentile(values, 0.99) * 1000:8.2f}ms"
+    ) if values else f"{name:<22} n=0"
+
+def make_requests(args) -> list[dict]:
+    """Build the request mix: a `hot_ratio` share of requests reuse a small hot query set."""
+    rng = random.Random(args.seed)
+    queries = read_lines(args.queries_file, DEFAULT_QUERIES)
+    urls = read_lines(args.urls_file, [])
+    hot = queries[:max(1, args.hot_queries)]
+    requests = []
+    for _ in range(args.requests):
+        pool = hot if rng.random() < args.hot_ratio else queries
+        requests.append({
+            "search_queries": [rng.choice(pool) for _ in range(args.queries_per_request)],
+            "full_text_requests": [rng.choice(urls) for _ in range(args.urls_per_request)] if urls else [],
+        })
+    return requests
+
+def parse_server_timing(header: str | None) -> dict[str, float]:
+    timings = {}
+    for entry in (header or "").split(","):
+        name, _, params = entry.strip().partition(";")
+        if params.startswith("dur="):
+            timings[name] = float(params[4:]) / 1000
+    return timings
+
+def run_load(args) -> None:
+    requests = make_requests(args)
+    endpoint = args.url.rstrip("/") + "/resources"
+
+    def send(body: dict) -> tuple[float, bool, dict[str, float]]:
+        data = json.dumps(body).encode("utf-8")
+        req = urllib.request.Request(endpoint, data=data, headers={"Content-Type": "application/json"})
+        start = time.perf_counter()
+        timings = {}
+        try:
+            with urllib.request.urlopen(req, timeout=args.timeout) as response:
+                response.read()
+                timings = parse_server_timing(response.headers.get("Server-Timing"))
+            ok = True
+        except Exception as e:
+            print(f"Request failed: {e}", file=sys.stderr)
+            ok = False
+        return time.perf_counter() - start, ok, timings
+
+    for body in requests[:args.warmup]:
+        send(body)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(args.concurrency) as pool:
+        results = list(pool.map(send, requests))
+    wall = time.perf_counter() - start
+
+    latencies = [latency for latency, ok, _ in results if ok]
+    errors = sum(not ok for _, ok, _ in results)
+    stages: dict[str, list[float]] = {}
+    for _, _, timings in results:
+        for stage, seconds in timings.items():
+            stages.setdefault(stage, []).append(seconds)
+    print(f"{len(requests)} requests, concurrency {args.concurrency}, {args.queries_per_request} queries/request")
+    print(f"Throughput: {len(latencies) / wall:.1f} req/s, {len(latencies) * args.queries_per_request / wall:.1f} queries/s, {errors} errors")
+    print(summarize("request", latencies))
+    for stage, seconds in stages.items():
+        print(summarize(stage, seconds))
+
+def run_stages(args) -> None:
+    from engine import SearchEngine, TextRetriever, to_rounds
+    from retrieval import make_retrieval_backend
+    from splade import Splade
+    from pydantic_models import ResourcesResponse
+
+    requests = make_requests(args)
+    splade = Splade(args.splade_backend, args.splade_onnx_path)
+    text_retriever = TextRetriever(args.url_to_text_path)
+    retriever = make_retrieval_backend(args.retrieval_backend, args.db_path, args.license_key, text_retriever.map, args.shards)
+    engine = SearchEngine(retriever, splade, cache_size=args.cache_size)
+
+    stages: dict[str, list[float]] = {name: [] for name in ("expansion", "retrieval", "full_text", "serialization", "total")}
+    for body in requests:
+        total_start = time.perf_counter()
+        start = time.perf_counter()
+        expanded = engine.expand(body["search_queries"])
+        stages["expansion"].append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        hits = retriever.search_batch(expanded, 10)
+        stages["retrieval"].append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        full_texts = text_retriever.retrieve(body["full_text_requests"])
+        stages["full_text"].append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        ResourcesResponse(
+            search_results=to_rounds(expanded, hits),
+            full_text_requests=full_texts,
+        ).model_dump_json()
+        stages["serialization"].append(time.perf_counter() - start)
+        stages["total"].append(time.perf_counter() - total_start)
+
+    print(f"{len(requests)} requests, {args.queries_per_request} queries/request, backend {args.retrieval_backend}/{args.splade_backend}")
+    for name, seconds in stages.items():
+        print(summarize(name, seconds))
+    print(f"Expansion cache: {engine.expansion_cache.stats()}")
+
+def wait_for(url: str, deadline: float, process: subprocess.Popen) -> float | None:
+    """Poll `url` until it answers 200; the perf_counter time it did, or None on timeout or exit."""
+    while time.perf_counter() < deadline and process.poll() is None:
+        try:
+            with urllib.request.urlopen(url, timeout=1) as response:
+                if response.status == 200:
+                    return time.perf_counter()
+        except OSError:
+            pass
+        time.sleep(0.01)
+    return None
+
+def run_startup(args) -> None:
+    server_args = [arg for arg in args.server_args if arg != "--"]
+    command = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py"),
+               "--port", str(args.port), *server_args]
+    base_url = f"http://127.0.0.1:{args.port}"
+    listen_times, ready_times = [], []
+    for run in range(args.runs):
+        start = time.perf_counter()
+        process = subprocess.Popen(command, stdout=None if args.verbose else subprocess.DEVNULL,
+                                   stderr=None if args.verbose else subprocess.DEVNULL)
+        try:
+            deadline = start + args.timeout
+            listening = wait_for(base_url + "/health", deadline, process)
+            ready = wait_for(base_url + "/ready", deadline, process) if listening else None
+        finally:
+            process.send_signal(signal.SIGTERM)
+            process.wait()
+        if ready is None:
+            print(f"Run {run + 1}: server did not become ready within {args.timeout:.0f}s (exit code {process.returncode})")
+            continue
+        listen_times.append(listening - start)
+        ready_times.append(ready - start)
+        print(f"Run {run + 1}: listening after {listen_times[-1] * 1000:.0f}ms, ready after {ready_times[-1] * 1000:.0f}ms")
+    print(f"{len(ready_times)}/{args.runs} runs ready: {' '.join(server_args)}")
+    print(summarize("time_to_listen", listen_times))
+    print(summarize("time_to_ready", ready_times))
+
+def main():
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="mode", required=True)
+    load = subparsers.add_parser("load", help="Drive a running server over HTTP")
+    load.add_argument("--url", type=str, default="http://localhost:8000")
+    load.add_argument("--concurrency", type=int, default=8)
+    load.add_argument("--warmup", type=int, default=10)
+    load.add_argument("--timeout", type=float, default=60.0)
+    stages = subparsers.add_parser("stages", help="Time each /resources stage in-process")
+    stages.add_argument("--retrieval-backend", type=str, choices=["neuraldb", "bm25"], default="bm25")
+    stages.add_argument("--license-key", type=str, default=None)
+    stages.add_argument("--db-path", type=str, nargs="+", default=["resources/splade-model"])
+    stages.add_argument("--shards", type=int, default=1, help="Split the bm25 corpus into this many shards")
+    stages.add_argument("--url-to-text-path", type=str, default="resources/url_to_text.json")
+    stages.add_argument("--splade-backend", type=str, choices=["torch", "torch-int8", "onnx"], default="torch")
+    stages.add_argument("--splade-onnx-path", type=str, default="resources/splade.onnx")
+    stages.add_argument("--cache-size", type=int, default=0, help="0 disables the expansion cache")
+    startup = subparsers.add_parser("startup", help="Time server startup until listening and until ready")
+    startup.add_argument("--runs", type=int, default=5)
+    startup.add_argument("--port", type=int, default=8765)
+    startup.add_argument("--timeout", type=float, default=300.0, help="Seconds to wait for /ready per run")
+    startup.add_argument("--verbose", action="store_true", help="Show the server's output")
+    startup.add_argument("server_args", nargs=argparse.REMAINDER, help="Arguments for main.py, after --")
+    for sub in (load, stages):
+        sub.add_argument("--requests", type=int, default=200)
+        sub.add_argument("--queries-file", type=str, default=None, help="One query per line")
+        sub.add_argument("--urls-file", type=str, default=None, help="One full-text URL per line")
+        sub.add_argument("--queries-per-request", type=int, default=3)
+        sub.add_argument("--urls-per-request", type=int, default=0)
+        sub.add_argument("--hot-queries", type=int, default=3, help="Size of the frequently repeated query set")
+        sub.add_argument("--hot-ratio", type=float, default=0.5, help="Share of requests drawn from the hot set")
+        sub.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.mode == "load":
+        run_load(args)
+    elif args.mode == "startup":
+        run_startup(args)
+    else:
+        run_stages(args)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+Parity check and benchmark for the SPLADE inference backends.
+
+Each backend runs in its own process so its resident memory can be measured
+in isolation. Expansions are compared against the first backend (the fp32
+PyTorch reference by default):
+
+    python bench_splade.py --backends torch torch-int8 onnx --repeats 5
+"""
+
+import argparse
+import multiprocessing as mp
+import resource
+import statistics
+import sys
+import time
+
+DEFAULT_QUERIES = [
+    "how do I report a noise complaint about my neighbor",
+    "banging or pounding noise at night",
+    "apply for food stamps snap benefits",
+    "renew a driver license online",
+    "heat or hot water not working in apartment",
+    "schedule bulk item trash pickup",
+    "property tax exemption for seniors",
+    "report a pothole on my street",
+]
+
+def rss_mb() -> float:
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+def run_backend(backend: str, onnx_path: str, queries: list[str], repeats: int, batch_size: int, results) -> None:
+    from splade import Splade
+
+    rss_before = rss_mb()
+    load_start = time.perf_counter()
+    splade = Splade(backend, onnx_path)
+    load_time = time.perf_counter() - load_start
+    rss_loaded = rss_mb()
+
+    splade.augment_batch(queries[:batch_size])  # warmup
+    per_query = []
+    for _ in range(repeats):
+        for i in range(0, len(queries), batch_size):
+            batch = queries[i:i + batch_size]
+            start = time.perf_counter()
+            splade.augment_batch(batch)
+            per_query.append((time.perf_counter() - start) / len(batch))
+
+    expansions = [set(expanded[len(query):].split()) for query, expanded in zip(queries, splade.augment_batch(queries))]
+    results.put({
+        "backend": backend,
+        "load_time": load_time,
+        "rss_model_mb": rss_loaded - rss_before,
+        "rss_peak_mb": rss_mb(),
+        "per_query": per_query,
+        "expansions": expansions,
+    })
+
+def jaccard(a: set, b: set) -> float:
+    return len(a & b) / len(a | b) if a or b else 1.0
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--backends", nargs="+", default=["torch", "torch-int8", "onnx"])
+    parser.add_argument("--onnx-path", type=str, default="resources/splade.onnx")
+    parser.add_argument("--queries-file", type=str, default=None, help="One query per line")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--batch-size", type=int, default=1)
+    parser.add_argument("--min-jaccard", type=float, default=0.9, help="Parity threshold against the reference backend")
+    args = parser.parse_args()
+
+    queries = DEFAULT_QUERIES
+    if args.queries_file:
+        with open(args.queries_file) as f:
+            queries = [line.strip() for line in f if line.strip()]
+
+    ctx = mp.get_context("spawn")
+    reports = []
+    for backend in args.backends:
+        results = ctx.Queue()
+        process = ctx.Process(
+            target=run_backend,
+            args=(backend, args.onnx_path, queries, args.repeats, args.batch_size, results),
+        )
+        process.start()
+        reports.append(results.get())
+        process.join()
+
+    reference = reports[0]
+    print(f"{len(queries)} queries, batch size {args.batch_size}, reference backend: {reference['backend']}")
+    print(f"{'backend':<12} {'load s':>8} {'p50 ms':>8} {'p95 ms':>8} {'model MB':>9} {'RSS MB':>8} {'jaccard':>8} {'exact':>6}")
+    failed = False
+    for report in reports:
+        latencies = sorted(report["per_query"])
+        p50 = statistics.median(latencies) * 1000
+        p95 = latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))] * 1000
+        similarities = [jaccard(a, b) for a, b in zip(report["expansions"], reference["expansions"])]
+        mean_jaccard = statistics.mean(similarities)
+        exact = sum(a == b for a, b in zip(report["expansions"], reference["expansions"]))
+        failed |= mean_jaccard < args.min_jaccard
+        print(
+            f"{report['backend']:<12} {report['load_time']:>8.2f} {p50:>8.2f} {p95:>8.2f} "
+            f"{report['rss_model_mb']:>9.1f} {report['rss_peak_mb']:>8.1f} {mean_jaccard:>8.3f} {exact:>3}/{len(queries)}"
+        )
+    if failed:
+        print(f"Parity check failed: mean token-set jaccard below {args.min_jaccard}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
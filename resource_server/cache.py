@@ -0,0 +1,88 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable
+
+MISSING = object()
+
+class LRUCache:
+    """
+    Thread-safe bounded LRU cache whose entries expire after `ttl` seconds.
+    Uses per entry (the put, every hit and every `touch`) are counted so the
+    most used entries can be persisted.
+    """
+
+    def __init__(self, max_size: int = 1024, ttl: float = 3600.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self._uses: dict[Hashable, int] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return MISSING
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                self._uses.pop(key, None)
+                self.misses += 1
+                return MISSING
+            self._entries.move_to_end(key)
+            self._uses[key] = self._uses.get(key, 0) + 1
+            self.hits += 1
+            return value
+
+    def touch(self, key: Hashable) -> None:
+        """Count a use of `key` served from elsewhere and keep it recently used, without counting a hit."""
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self._uses[key] = self._uses.get(key, 0) + 1
+
+    def put(self, key: Hashable, value: Any, uses: int = 1) -> None:
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            self._uses[key] = self._uses.get(key, 0) + uses
+            while len(self._entries) > self.max_size:
+                evicted, _ = self._entries.popitem(last=False)
+                self._uses.pop(evicted, None)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._uses.clear()
+
+    def most_used(self, limit: int) -> list[tuple[Hashable, Any, int]]:
+        """Up to `limit` live (key, value, uses) entries, most used first."""
+        now = time.monotonic()
+        with self._lock:
+            live = [
+                (key, value, self._uses.get(key, 0))
+                for key, (expires_at, value) in self._entries.items()
+                if expires_at >= now
+            ]
+        live.sort(key=lambda entry: entry[2], reverse=True)
+        return live[:limit]
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
@@ -1,45 +1,315 @@
-from splade import Splade
+import fcntl
+import json
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import TYPE_CHECKING, Any
+import numpy as np
+from cache import LRUCache, MISSING
+from text_store import TextStore, excerpt, is_text_store
+from pydantic_models import SearchRound, SearchResult, FullTextRequest, FullTextSpec
+from retrieval import Hit, RetrievalBackend
+from metrics import REGISTRY, stage_histogram
+from sparse_index import SparseIndex, sparse_rows
 
-splade = Splade()
+if TYPE_CHECKING:
+    # Imported lazily by the caller: loading torch and transformers dominates startup
+    from splade import Splade
 
-import json
-from thirdai import licensing
-from thirdai import neural_db_v2 as ndb
-from pydantic_models import SearchRound, SearchResult, FullTextRequest
-
-class SearchEngine:
-    def __init__(self, db_path: str, license_key: str):
-        print(f"Activating license {license_key}")
-        licensing.activate(license_key)
-        self.db = ndb.NeuralDB.load(db_path)
-
-    def search(self, queries: list[str], top_k: int = 10) -> list[SearchRound]:
-        queries = [splade.augment(query) for query in queries]
-        results = self.db.search_batch(queries=queries, top_k=top_k)
-        return [
-            SearchRound(
-                query=query,
-                results=[
-                    SearchResult(
-                    page=result[0].document,
-                    text=result[0].metadata["original"] if result[0].metadata and "original" in result[0].metadata else result[0].text
-                )
-                    for result in query_results
-                ]
-            )
-            for query, query_results in zip(queries, results)
-        ]
+EXPANSION_SECONDS = stage_histogram("expansion")
+RETRIEVAL_SECONDS = stage_histogram("retrieval")
+FULL_TEXT_SECONDS = stage_histogram("full_text")
+FULL_TEXT_MISSES = REGISTRY.counter(
+    "resource_server_full_text_misses", "Full-text requests for URLs missing from the corpus"
+)
+
+def normalize_query(query: str) -> str:
+    return " ".join(query.lower().split())
+
+class CachedSearchEngine(ABC):
+    """
+    Result caching shared by the search engines: subclasses implement
+    `_search_uncached` for the queries missing from the result cache.
+    """
+
+    def __init__(self, splade: "Splade", cache_size: int = 1024, cache_ttl: float = 3600.0):
+        self.splade = splade
+        self._generation = 0
+        # Expansions only depend on the SPLADE model, search rounds also depend on the index.
+        self.expansion_cache = LRUCache(cache_size, cache_ttl)
+        self.result_cache = LRUCache(cache_size, cache_ttl)
+        self._reload_lock = threading.Lock()
+        # Use counts of the expansions loaded from a snapshot, see save_expansions
+        self._loaded_uses: dict[str, int] = {}
+
+    @abstractmethod
+    def _reload_index(self) -> None:
+        ...
+
+    @abstractmethod
+    def _search_uncached(self, queries: list[str], top_k: int, timings: dict[str, float] | None) -> list[SearchRound]:
+        ...
+
+    def reload(self) -> None:
+        with self._reload_lock:
+            self._reload_index()
+            self._generation += 1
+            self.result_cache.clear()
+
+    def invalidate_cache(self) -> None:
+        self.expansion_cache.clear()
+        self.result_cache.clear()
+
+    def cache_stats(self) -> dict[str, dict[str, int]]:
+        return {
+            "expansions": self.expansion_cache.stats(),
+            "results": self.result_cache.stats(),
+        }
+
+    def _expansion_fingerprint(self) -> str:
+        # Expansions differ between models, inference backends and engine kinds
+        return f"{type(self).__name__}|{self.splade.model_name}|{self.splade.backend}"
+
+    def _dump_expansion(self, expansion) -> Any:
+        return expansion
+
+    def _load_expansion(self, data: Any):
+        return data
+
+    def save_expansions(self, path: str, limit: int, exclude: list[str] | None = None) -> int:
+        """
+        Merge this process's query expansions into the snapshot at `path`,
+        keeping the `limit` most used; returns how many were written. Queries
+        in `exclude` are left out, e.g. warmup queries that must still reach
+        the model on the next start.
+
+        Pre-forked workers each save when they exit, recycled ones included.
+        Under an exclusive lock, each adds only the uses it counted since the
+        snapshot was loaded to the counts already in the file, so a worker
+        that served little never replaces what busier workers saved.
+        """
+        skip = {normalize_query(query) for query in exclude or []}
+        with open(f"{path}.lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                saved = self._read_expansions(path)
+            except (ValueError, KeyError):
+                saved = []  # unreadable snapshot: replace it
+            merged = {query: [data, uses] for query, data, uses in saved}
+            current = self.expansion_cache.most_used(self.expansion_cache.max_size)
+            for query, expansion, uses in current:
+                if query in skip:
+                    continue
+                added = max(0, uses - self._loaded_uses.get(query, 0))
+                if query in merged:
+                    merged[query][1] += added
+                else:
+                    merged[query] = [self._dump_expansion(expansion), added]
+            entries = sorted(merged.items(), key=lambda item: item[1][1], reverse=True)[:limit]
+            snapshot = {
+                "fingerprint": self._expansion_fingerprint(),
+                "expansions": [[query, data, uses] for query, (data, uses) in entries],
+            }
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(snapshot, f)
+            os.replace(tmp_path, path)
+            # Uses saved now are in the file; a later save only adds newer ones
+            self._loaded_uses = {query: uses for query, _, uses in current}
+        return len(entries)
+
+    def _read_expansions(self, path: str) -> list:
+        """[query, data, uses] entries of a snapshot made with the same model and backend, else none."""
+        if not os.path.exists(path):
+            return []
+        with open(path, "r") as f:
+            snapshot = json.load(f)
+        if snapshot.get("fingerprint") != self._expansion_fingerprint():
+            return []
+        return snapshot["expansions"]
+
+    def load_expansions(self, path: str) -> int:
+        """Prime the expansion cache from a `save_expansions` file made with the same model and backend."""
+        # Stored most used first; insert in reverse so they are also the most recently used.
+        # Use counts carry over, so queries stay ranked across restarts.
+        expansions = self._read_expansions(path)[:self.expansion_cache.max_size]
+        for query, data, uses in reversed(expansions):
+            self.expansion_cache.put(query, self._load_expansion(data), uses)
+        self._loaded_uses = {query: uses for query, _, uses in expansions}
+        return len(expansions)
+
+    def collect_metrics(self):
+        for tier, stats in self.cache_stats().items():
+            labels = {"tier": tier}
+            yield "resource_server_cache_hits", "counter", "Search cache hits", labels, stats["hits"]
+            yield "resource_server_cache_misses", "counter", "Search cache misses", labels, stats["misses"]
+            yield "resource_server_cache_evictions", "counter", "Search cache LRU evictions", labels, stats["evictions"]
+            yield "resource_server_cache_entries", "gauge", "Entries currently held by the search cache", labels, stats["size"]
+
+    def search(self, queries: list[str], top_k: int = 10, timings: dict[str, float] | None = None) -> list[SearchRound]:
+        """
+        Search the queries, adding per-stage seconds to `timings` when given.
+        Queries differing only in case and whitespace share cache entries; the
+        first one seen is what gets expanded and reported.
+        """
+        keys = [normalize_query(query) for query in queries]
+        originals: dict[str, str] = {}
+        for key, query in zip(keys, queries):
+            originals.setdefault(key, query)
+        rounds = {}
+        missing = []
+        for key in originals:
+            cached = self.result_cache.get((key, top_k))
+            if cached is MISSING:
+                missing.append(key)
+            else:
+                # Repeat queries stop here: count them toward the expansions worth persisting
+                self.expansion_cache.touch(key)
+                rounds[key] = cached
+        if missing:
+            generation = self._generation
+            searched = self._search_uncached([originals[key] for key in missing], top_k, timings)
+            for key, search_round in zip(missing, searched):
+                # Don't cache rounds computed against an index that was reloaded meanwhile.
+                if generation == self._generation:
+                    self.result_cache.put((key, top_k), search_round)
+                rounds[key] = search_round
+        return [rounds[key] for key in keys]
+
+    def _cached_expansions(self, queries: list[str], expand_fn) -> list:
+        """
+        Look up each query's expansion under its normalized form, computing
+        the misses in one `expand_fn` batch over the original text.
+        """
+        keys = [normalize_query(query) for query in queries]
+        originals: dict[str, str] = {}
+        for key, query in zip(keys, queries):
+            originals.setdefault(key, query)
+        expanded = {}
+        missing = []
+        for key in originals:
+            cached = self.expansion_cache.get(key)
+            if cached is MISSING:
+                missing.append(key)
+            else:
+                expanded[key] = cached
+        if missing:
+            for key, expansion in zip(missing, expand_fn([originals[key] for key in missing])):
+                self.expansion_cache.put(key, expansion)
+                expanded[key] = expansion
+        return [expanded[key] for key in keys]
+
+def record_stages(timings: dict[str, float] | None, start: float, expanded_at: float, retrieved_at: float) -> None:
+    EXPANSION_SECONDS.observe(expanded_at - start)
+    RETRIEVAL_SECONDS.observe(retrieved_at - expanded_at)
+    if timings is not None:
+        timings["expansion"] = timings.get("expansion", 0.0) + expanded_at - start
+        timings["retrieval"] = timings.get("retrieval", 0.0) + retrieved_at - expanded_at
+
+def to_rounds(queries: list[str], results: list[list[Hit]]) -> list[SearchRound]:
+    return [
+        SearchRound(
+            query=query,
+            results=[
+                SearchResult(page=hit.page, text=hit.text)
+                for hit in query_results
+            ]
+        )
+        for query, query_results in zip(queries, results)
+    ]
+
+class SearchEngine(CachedSearchEngine):
+    """Appends SPLADE expansion terms to each query and runs the text against a RetrievalBackend."""
+
+    def __init__(self, retriever: RetrievalBackend, splade: "Splade", cache_size: int = 1024, cache_ttl: float = 3600.0):
+        super().__init__(splade, cache_size, cache_ttl)
+        self.retriever = retriever
+
+    def _reload_index(self) -> None:
+        self.retriever.reload()
+
+    def expand(self, queries: list[str]) -> list[str]:
+        """Expand queries, running SPLADE only on cache misses."""
+        return self._cached_expansions(queries, self.splade.augment_batch)
+
+    def _search_uncached(self, queries: list[str], top_k: int, timings: dict[str, float] | None) -> list[SearchRound]:
+        start = time.perf_counter()
+        expanded = self.expand(queries)
+        expanded_at = time.perf_counter()
+        results = self.retriever.search_batch(expanded, top_k)
+        record_stages(timings, start, expanded_at, time.perf_counter())
+        return to_rounds(expanded, results)
+
+class SparseSearchEngine(CachedSearchEngine):
+    """
+    Scores SPLADE query vectors, weights included, against a SparseIndex of
+    SPLADE document vectors instead of re-tokenizing expanded query text.
+    """
+
+    def __init__(self, index: SparseIndex, splade: "Splade", cache_size: int = 1024, cache_ttl: float = 3600.0):
+        super().__init__(splade, cache_size, cache_ttl)
+        self.index = index
+
+    def _reload_index(self) -> None:
+        self.index.reload()
+
+    def _encode(self, queries: list[str]) -> list[tuple[np.ndarray, np.ndarray]]:
+        return sparse_rows(self.splade.encode(queries))
+
+    def _dump_expansion(self, expansion: tuple[np.ndarray, np.ndarray]) -> Any:
+        term_ids, weights = expansion
+        return [term_ids.tolist(), weights.tolist()]
+
+    def _load_expansion(self, data: Any) -> tuple[np.ndarray, np.ndarray]:
+        term_ids, weights = data
+        return np.asarray(term_ids, dtype=np.int64), np.asarray(weights, dtype=np.float32)
+
+    def _search_uncached(self, queries: list[str], top_k: int, timings: dict[str, float] | None) -> list[SearchRound]:
+        start = time.perf_counter()
+        vectors = self._cached_expansions(queries, self._encode)
+        expanded_at = time.perf_counter()
+        results = [self.index.search(term_ids, weights, top_k) for term_ids, weights in vectors]
+        record_stages(timings, start, expanded_at, time.perf_counter())
+        # Report the expanded query text, like SearchEngine, whichever backend scored it
+        expanded = [self.splade.expanded_text(query, term_ids) for query, (term_ids, _) in zip(queries, vectors)]
+        return to_rounds(expanded, results)
 
 class TextRetriever:
     def __init__(self, map_location: str):
-        with open(map_location, "r") as f:
-            self.map = json.load(f)
+        # Prefer the memory-mapped store built by text_store.py, fall back to the raw JSON map.
+        if is_text_store(map_location):
+            self.map = TextStore(map_location)
+        else:
+            with open(map_location, "r") as f:
+                self.map = json.load(f)
 
-    def retrieve(self, urls: list[str]) -> list[FullTextRequest]:
-        return [
+    def retrieve(self, requests: list[str | FullTextSpec]) -> list[FullTextRequest]:
+        """Look up whole texts for URLs and excerpts for FullTextSpecs."""
+        start = time.perf_counter()
+        full_texts = [
             FullTextRequest(
-                url=url,
-                text=self.map[url]
-            )
-            for url in urls
-        ]
\ No newline at end of file
+                url=request,
+                text=self.map.get(request)
+            ) if isinstance(request, str) else self._excerpt(request)
+            for request in requests
+        ]
+        FULL_TEXT_SECONDS.observe(time.perf_counter() - start)
+        misses = sum(full_text.text is None for full_text in full_texts)
+        if misses:
+            FULL_TEXT_MISSES.inc(misses)
+        return full_texts
+
+    def _excerpt(self, spec: FullTextSpec) -> FullTextRequest:
+        if isinstance(self.map, TextStore):
+            found = self.map.excerpt(spec.url, spec.start, spec.length, spec.snippet)
+        else:
+            text = self.map.get(spec.url)
+            found = None
+            if text is not None:
+                encoded = text.encode("utf-8")
+                found = (*excerpt(encoded, 0, len(encoded), spec.start, spec.length, spec.snippet), len(encoded))
+        if found is None:
+            return FullTextRequest(url=spec.url, text=None)
+        text, offset, total_bytes = found
+        return FullTextRequest(url=spec.url, text=text, start=offset, total_bytes=total_bytes)
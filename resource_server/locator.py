@@ -0,0 +1,162 @@
+import asyncio
+import glob
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+from metrics import REGISTRY, stage_histogram
+from pydantic_models import ElementMatch, LocatedElement, LocateResponse
+
+TEMPLATE_MATCHING_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "guide", "template_matching")
+# Appended, not prepended: guide modules (e.g. test.py) must not shadow the stdlib or this server's modules
+sys.path.append(TEMPLATE_MATCHING_DIR)
+from matcher import MultiScaleTemplateMatcher
+from plan_index import PlanIndex
+from template_bank import TemplateBank
+
+DEFAULT_SCALES = [0.5, 0.75, 1.0, 1.25, 1.5, 2.0]
+
+DECODE_SECONDS = stage_histogram("locate_decode")
+LOCATE_QUEUE_SECONDS = stage_histogram("locate_queue")
+MATCH_SECONDS = stage_histogram("locate_match")
+PENDING = REGISTRY.gauge("resource_server_locate_pending", "/locate requests queued or matching")
+REJECTED = REGISTRY.counter("resource_server_locate_rejected", "/locate requests rejected because the queue was full")
+
+class LocatorBusy(Exception):
+    """Raised when `max_pending` /locate requests are already queued or running."""
+
+class ElementLocator:
+    """
+    Finds UI elements on a screenshot with MultiScaleTemplateMatcher against a
+    TemplateBank loaded once at startup, so a request only decodes its image
+    and matches; nothing is read from disk or written per request.
+
+    Elements are requested by plan `element_id` (every template of the
+    element's group is tried, e.g. a dropdown's closed and open state) or by
+    template file name, with or without `.png`.
+
+    Matching runs on its own `num_workers` threads, separate from the search
+    executor, and cv2 releases the GIL while matching, so screenshots never
+    stall the event loop or /resources. At most `max_pending` requests are
+    queued or running; further requests fail fast with LocatorBusy.
+    """
+
+    def __init__(
+        self,
+        elements_dir: str,
+        plan_path: str | None = None,
+        scales: list[float] | None = None,
+        threshold: float = 0.6,
+        search_mode: str = "coarse_to_fine",
+        num_workers: int = 1,
+        max_pending: int = 8,
+        cache_dir: str | None = None,
+    ):
+        element_files = sorted(glob.glob(os.path.join(elements_dir, "*.png")))
+        if not element_files:
+            raise FileNotFoundError(f"No element templates in {elements_dir}")
+        self.matcher_config = {
+            "scales": scales or DEFAULT_SCALES,
+            "threshold": threshold,
+            "search_mode": search_mode,
+            "verbosity": 0,
+        }
+        self.template_bank = TemplateBank.from_files(element_files, self.matcher_config["scales"], cache_dir)
+        self.element_templates: dict[str, tuple[str, ...]] = {}
+        if plan_path and os.path.exists(plan_path):
+            plan = PlanIndex.from_file(plan_path)
+            self.element_templates = {
+                element_id: tuple(name for name in group if name in self.template_bank)
+                for element_id, group in plan.element_templates.items()
+            }
+        self.num_workers = num_workers
+        self.max_pending = max_pending
+        self._pending = 0
+        self._local = threading.local()
+        self._executor: ThreadPoolExecutor | None = None
+
+    def start(self, cv2_threads: int | None = None) -> None:
+        # Created after fork, like SearchBatcher's executor
+        if cv2_threads:
+            cv2.setNumThreads(cv2_threads)
+        self._executor = ThreadPoolExecutor(self.num_workers, thread_name_prefix="locate")
+
+    def stop(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+
+    def resolve(self, element_id: str) -> tuple[str, ...]:
+        """Template names for an element id; raises KeyError for unknown ids."""
+        if element_id in self.element_templates:
+            return self.element_templates[element_id]
+        for name in (element_id, f"{element_id}.png"):
+            if name in self.template_bank:
+                return (name,)
+        raise KeyError(element_id)
+
+    async def locate(self, image_bytes: bytes, element_ids: list[str], top_k: int = 5) -> LocateResponse:
+        """
+        Match the requested elements on an encoded screenshot.
+
+        Raises:
+            KeyError: An element id matches neither a plan element nor a template
+            ValueError: The image could not be decoded
+            LocatorBusy: `max_pending` requests are already queued or running
+        """
+        groups = [(element_id, self.resolve(element_id)) for element_id in element_ids]
+        if self._pending >= self.max_pending:
+            REJECTED.inc()
+            raise LocatorBusy(f"{self._pending} /locate requests pending")
+        self._pending += 1
+        PENDING.inc()
+        enqueued_at = time.perf_counter()
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, self._locate, image_bytes, groups, top_k, enqueued_at)
+        finally:
+            self._pending -= 1
+            PENDING.dec()
+
+    def _matcher(self) -> MultiScaleTemplateMatcher:
+        # The matcher caches per-layout state, so each thread keeps its own
+        matcher = getattr(self._local, "matcher", None)
+        if matcher is None:
+            matcher = self._local.matcher = MultiScaleTemplateMatcher(**self.matcher_config)
+        return matcher
+
+    def _locate(
+        self, image_bytes: bytes, groups: list[tuple[str, tuple[str, ...]]], top_k: int, enqueued_at: float
+    ) -> LocateResponse:
+        timings = {"queue": time.perf_counter() - enqueued_at}
+        LOCATE_QUEUE_SECONDS.observe(timings["queue"])
+
+        start = time.perf_counter()
+        image = cv2.imdecode(np.frombuffer(image_bytes, dtype=np.uint8), cv2.IMREAD_GRAYSCALE)
+        timings["decode"] = time.perf_counter() - start
+        DECODE_SECONDS.observe(timings["decode"])
+        if image is None:
+            raise ValueError("Could not decode the screenshot")
+
+        start = time.perf_counter()
+        matcher = self._matcher()
+        elements = []
+        for element_id, names in groups:
+            matches = []
+            for name in names:
+                found, _ = matcher.multi_scale_template_match(
+                    image, self.template_bank.template(name), self.template_bank.scaled_templates(name))
+                matches.extend(
+                    ElementMatch(x=x, y=y, width=w, height=h, confidence=score, template=name)
+                    for x, y, w, h, score in found
+                )
+            matches.sort(key=lambda match: match.confidence, reverse=True)
+            elements.append(LocatedElement(element_id=element_id, matches=matches[:top_k]))
+        timings["match"] = time.perf_counter() - start
+        MATCH_SECONDS.observe(timings["match"])
+
+        height, width = image.shape[:2]
+        return LocateResponse(width=width, height=height, elements=elements, timings=timings)
@@ -1,36 +1,386 @@
 import argparse
 
 parser = argparse.ArgumentParser()
-parser.add_argument("--license-key", type=str, required=True)
-parser.add_argument("--db-path", type=str, default="resources/splade-model")
+parser.add_argument("--retrieval-backend", type=str, choices=["neuraldb", "bm25", "sparse"], default="neuraldb")
+parser.add_argument("--license-key", type=str, default=None)
+parser.add_argument("--db-path", type=str, nargs="+", default=["resources/splade-model"],
+                    help="NeuralDB path; several paths are searched as shards")
+parser.add_argument("--shards", type=int, default=1, help="Split the bm25 corpus into this many shards searched in parallel")
+parser.add_argument("--sparse-index-path", type=str, default="resources/sparse-index")
 parser.add_argument("--url-to-text-path", type=str, default="resources/url_to_text.json")
+parser.add_argument("--splade-backend", type=str, choices=["torch", "torch-int8", "onnx"], default="torch")
+parser.add_argument("--splade-onnx-path", type=str, default="resources/splade.onnx")
+parser.add_argument("--cache-size", type=int, default=1024)
+parser.add_argument("--cache-ttl", type=float, default=3600.0)
+parser.add_argument("--max-batch-size", type=int, default=32)
+parser.add_argument("--max-wait-ms", type=float, default=5.0)
+parser.add_argument("--search-workers", type=int, default=1)
+parser.add_argument("--host", type=str, default="0.0.0.0")
+parser.add_argument("--port", type=int, default=8000)
+parser.add_argument("--workers", type=int, default=1, help="Pre-fork this many workers sharing the loaded models copy-on-write")
+parser.add_argument("--torch-threads", type=int, default=None, help="Intra-op threads per worker (default: cores / workers)")
+parser.add_argument("--max-requests-per-worker", type=int, default=None, help="Gracefully recycle a worker after this many requests")
+parser.add_argument("--server-timing", action="store_true", help="Add a Server-Timing header with per-stage latencies to /resources and /locate")
+parser.add_argument("--compress-min-bytes", type=int, default=1024, help="Compress /resources bodies at least this large when the client accepts zstd or gzip")
+parser.add_argument("--elements-dir", type=str, default="../guide/screenshots/elements", help="Element templates served by /locate")
+parser.add_argument("--plan-path", type=str, default="../guide/plan.json", help="Guide plan mapping element ids to templates")
+parser.add_argument("--template-cache-dir", type=str, default="resources/template-cache")
+parser.add_argument("--locate-workers", type=int, default=1, help="Threads matching /locate screenshots")
+parser.add_argument("--locate-max-pending", type=int, default=8, help="Reject /locate requests beyond this many queued or running")
+parser.add_argument("--fast-start", action="store_true", help="Listen immediately and load models and indexes in the background; /ready turns 200 once they are loaded and warm")
+parser.add_argument("--expansion-cache-path", type=str, default="resources/expansion-cache.json", help="Query expansions saved at shutdown and reloaded at startup (empty to disable)")
+parser.add_argument("--expansion-cache-entries", type=int, default=10000, help="Most used query expansions to save at shutdown")
 args = parser.parse_args()
+if args.retrieval_backend == "neuraldb" and not args.license_key:
+    parser.error("--license-key is required for the neuraldb retrieval backend")
+if args.fast_start and args.workers > 1:
+    parser.error("--fast-start needs --workers 1: pre-forked workers share models loaded before the fork")
 
-from fastapi import FastAPI
+import asyncio
+import os
+import sys
+import time
+import traceback
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Header, HTTPException, Query, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+from pydantic import BaseModel
+from starlette.concurrency import run_in_threadpool
 import uvicorn
-from engine import SearchEngine, TextRetriever
-from pydantic_models import ResourcesRequest, ResourcesResponse
+from engine import SearchEngine, SparseSearchEngine, TextRetriever, normalize_query
+from metrics import REGISTRY, MetricsMiddleware, server_timing, stage_histogram
+from prefork import PreforkServer
+from pydantic_models import FullTextSpec, LocateResponse, ResourcesRequest, ResourcesResponse
+from retrieval import make_retrieval_backend
+from scheduler import SearchBatcher
+from serialization import compress, negotiate_encoding, negotiate_media_type, serialize
+from singleflight import SingleFlight
+from sparse_index import SparseIndex
 
 
-app = FastAPI()
+splade = None
+text_retriever = None
+search_engine = None
+search_batcher = None
+element_locator = None
+server: uvicorn.Server | None = None
 
-search_engine = SearchEngine(args.db_path, args.license_key)
-text_retriever = TextRetriever(args.url_to_text_path)
+def load_components() -> None:
+    """
+    Load the model, indexes and element templates. torch, transformers and
+    cv2 are imported here rather than at the top, so with --fast-start the
+    port is bound before any of them is loaded.
+    """
+    global splade, text_retriever, search_engine, search_batcher, element_locator
+    from splade import Splade
+
+    splade = Splade(args.splade_backend, args.splade_onnx_path)
+    text_retriever = TextRetriever(args.url_to_text_path)
+    if args.retrieval_backend == "sparse":
+        search_engine = SparseSearchEngine(SparseIndex(args.sparse_index_path), splade, args.cache_size, args.cache_ttl)
+    else:
+        retriever = make_retrieval_backend(args.retrieval_backend, args.db_path, args.license_key, text_retriever.map, args.shards)
+        search_engine = SearchEngine(retriever, splade, args.cache_size, args.cache_ttl)
+    if args.expansion_cache_path and os.path.exists(args.expansion_cache_path):
+        try:
+            loaded = search_engine.load_expansions(args.expansion_cache_path)
+            print(f"Loaded {loaded} cached query expansions from {args.expansion_cache_path}")
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Ignoring expansion cache {args.expansion_cache_path}: {e}")
+    search_batcher = SearchBatcher(
+        search_engine.search,
+        max_batch_size=args.max_batch_size,
+        max_wait_ms=args.max_wait_ms,
+        num_workers=args.search_workers,
+    )
+    REGISTRY.register_collector(search_engine.collect_metrics)
+    if os.path.isdir(args.elements_dir):
+        from locator import ElementLocator
+
+        element_locator = ElementLocator(
+            args.elements_dir,
+            args.plan_path,
+            num_workers=args.locate_workers,
+            max_pending=args.locate_max_pending,
+            cache_dir=args.template_cache_dir,
+        )
+    else:
+        print(f"No element templates at {args.elements_dir}, /locate is disabled")
+    if args.fast_start and args.torch_threads:
+        splade.set_num_threads(args.torch_threads)
+
+if not args.fast_start:
+    load_components()
+
+VALIDATION_SECONDS = stage_histogram("validation")
+SERIALIZATION_SECONDS = stage_histogram("serialization")
+COMPRESSION_SECONDS = stage_histogram("compression")
+search_flight = SingleFlight("search")
+full_text_flight = SingleFlight("full_text")
+
+WARMUP_QUERIES = ["how do I report a noise complaint"]
+
+async def warm_up(app: FastAPI) -> None:
+    try:
+        await search_batcher.search(WARMUP_QUERIES)
+        app.state.ready = True
+    except Exception as e:
+        print(f"Warmup failed: {e}")
+
+def start_components(app: FastAPI) -> None:
+    if element_locator is not None:
+        element_locator.start(args.locate_workers)
+    app.state.loaded = True
+
+async def start_when_loaded(app: FastAPI, loading: asyncio.Task) -> None:
+    try:
+        start = time.perf_counter()
+        # Shielded: cancelling startup must not abandon the load thread, see lifespan
+        await asyncio.shield(loading)
+        await search_batcher.start()
+        start_components(app)
+        print(f"Loaded models and indexes in {time.perf_counter() - start:.2f}s")
+    except Exception:
+        traceback.print_exc()
+        # Exit instead of staying up unready forever, so a supervisor restarts the server
+        app.state.load_failed = True
+        if server is not None:
+            server.should_exit = True
+        return
+    await warm_up(app)
+
+def save_expansions() -> None:
+    if not args.expansion_cache_path:
+        return
+    try:
+        saved = search_engine.save_expansions(
+            args.expansion_cache_path, args.expansion_cache_entries, exclude=WARMUP_QUERIES
+        )
+        print(f"Saved {saved} query expansions to {args.expansion_cache_path}")
+    except OSError as e:
+        print(f"Could not save query expansions: {e}")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    app.state.ready = False
+    app.state.loaded = False
+    app.state.load_failed = False
+    loading = None
+    if args.fast_start:
+        loading = asyncio.create_task(asyncio.to_thread(load_components))
+        startup = asyncio.create_task(start_when_loaded(app, loading))
+    else:
+        await search_batcher.start()
+        start_components(app)
+        startup = asyncio.create_task(warm_up(app))
+    yield
+    startup.cancel()
+    if loading is not None:
+        # A load thread cannot be interrupted: wait for it, so nothing below sees half-built components
+        await asyncio.wait([loading])
+    if not app.state.loaded:
+        return
+    await search_batcher.stop()
+    if element_locator is not None:
+        element_locator.stop()
+    save_expansions()
+
+app = FastAPI(lifespan=lifespan)
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+def require_loaded() -> None:
+    """503 while --fast-start is still loading models and indexes."""
+    if not app.state.loaded:
+        raise HTTPException(status_code=503, detail="Loading models and indexes", headers={"Retry-After": "1"})
+
+async def coalesced_search(queries: list[str], timings: dict[str, float] | None = None):
+    """Search rounds for the queries; a query already being searched for another request is waited for, not repeated."""
+    return await search_flight.do_batch(
+        queries,
+        lambda missing: search_batcher.search(missing, timings=timings),
+        key=normalize_query,
+    )
+
+async def coalesced_full_texts(requests: list[str | FullTextSpec]):
+    """Full texts or excerpts; identical lookups in flight for other requests are shared."""
+    return await full_text_flight.do_batch(
+        requests,
+        lambda missing: run_in_threadpool(text_retriever.retrieve, missing),
+        key=lambda request: request if isinstance(request, str) else request.key(),
+    )
+
+def ndjson_record(record_type: str, index: int, data: BaseModel) -> bytes:
+    return f'{{"type":"{record_type}","index":{index},"data":{data.model_dump_json(exclude_unset=True)}}}\n'.encode("utf-8")
+
+async def resource_records(request: ResourcesRequest):
+    """
+    Yield one NDJSON record per full-text lookup and per search round as soon
+    as each is ready. Full texts do not wait on search, so they come first;
+    search rounds follow in completion order, tagged with their query index.
+    """
+    async def indexed_search(index: int, query: str):
+        (search_round,) = await coalesced_search([query])
+        return index, search_round
+
+    search_tasks = [
+        asyncio.ensure_future(indexed_search(i, query))
+        for i, query in enumerate(request.search_queries)
+    ]
+    try:
+        full_text_requests = await coalesced_full_texts(request.full_text_requests)
+        for i, full_text_request in enumerate(full_text_requests):
+            yield ndjson_record("full_text_request", i, full_text_request)
+        for task in asyncio.as_completed(search_tasks):
+            i, search_round = await task
+            yield ndjson_record("search_round", i, search_round)
+    finally:
+        for task in search_tasks:
+            task.cancel()
+
+@app.post("/resources/stream")
+async def stream_resources(request: ResourcesRequest) -> StreamingResponse:
+    require_loaded()
+    return StreamingResponse(resource_records(request), media_type=NDJSON_MEDIA_TYPE)
 
 @app.post("/resources", response_model=ResourcesResponse)
-async def get_resources(request: ResourcesRequest) -> ResourcesResponse:
-    search_results = search_engine.search(request.search_queries)
-    full_text_requests = text_retriever.retrieve(request.full_text_requests)
+async def get_resources(
+    request: ResourcesRequest,
+    accept: str | None = Header(default=None),
+    accept_encoding: str | None = Header(default=None),
+):
+    require_loaded()
+    if accept and NDJSON_MEDIA_TYPE in accept:
+        return await stream_resources(request)
+
+    timings: dict[str, float] = {}
+
+    async def timed_full_text():
+        start = time.perf_counter()
+        full_text_requests = await coalesced_full_texts(request.full_text_requests)
+        timings["full_text"] = time.perf_counter() - start
+        return full_text_requests
+
+    search_results, full_text_requests = await asyncio.gather(
+        coalesced_search(request.search_queries, timings=timings),
+        timed_full_text(),
+    )
 
-    return ResourcesResponse(
+    start = time.perf_counter()
+    response = ResourcesResponse(
         search_results=search_results,
         full_text_requests=full_text_requests
     )
+    validated_at = time.perf_counter()
+    # Serialize once here instead of letting FastAPI re-validate against response_model.
+    media_type = negotiate_media_type(accept)
+    body = serialize(response, media_type)
+    serialized_at = time.perf_counter()
+    VALIDATION_SECONDS.observe(validated_at - start)
+    SERIALIZATION_SECONDS.observe(serialized_at - validated_at)
+
+    timings["validation"] = validated_at - start
+    timings["serialization"] = serialized_at - validated_at
+
+    headers = {"Vary": "Accept, Accept-Encoding"}
+    encoding = negotiate_encoding(accept_encoding) if len(body) >= args.compress_min_bytes else None
+    if encoding:
+        # Large bodies are mostly page text: compress off the event loop
+        body = await run_in_threadpool(compress, body, encoding)
+        timings["compression"] = time.perf_counter() - serialized_at
+        COMPRESSION_SECONDS.observe(timings["compression"])
+        headers["Content-Encoding"] = encoding
+    if args.server_timing:
+        headers["Server-Timing"] = server_timing(timings)
+    return Response(content=body, media_type=media_type, headers=headers)
+
+@app.post("/locate", response_model=LocateResponse)
+async def locate_elements(request: Request, element_id: list[str] = Query(...), top_k: int = 5):
+    """
+    Find elements on a screenshot. The request body is the encoded image (PNG,
+    JPEG, ...); `element_id` is repeated once per element to look for.
+    """
+    from locator import LocatorBusy
+
+    require_loaded()
+    if element_locator is None:
+        raise HTTPException(status_code=503, detail="No element templates loaded")
+    start = time.perf_counter()
+    image_bytes = await request.body()
+    try:
+        response = await element_locator.locate(image_bytes, element_id, top_k)
+    except KeyError as e:
+        raise HTTPException(status_code=400, detail=f"Unknown element id {e.args[0]!r}")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except LocatorBusy as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+    response.timings["total"] = time.perf_counter() - start
+
+    headers = None
+    if args.server_timing:
+        headers = {"Server-Timing": server_timing(response.timings)}
+    return Response(content=response.model_dump_json(), media_type="application/json", headers=headers)
+
+@app.post("/admin/reload")
+def reload_db():
+    """Reload the retrieval index (the NeuralDB shards at --db-path) and drop cached search results"""
+    require_loaded()
+    search_engine.reload()
+    return {"status": "reloaded", "cache": search_engine.cache_stats()}
+
+@app.get("/admin/cache")
+async def get_cache_stats():
+    require_loaded()
+    return search_engine.cache_stats()
+
+@app.delete("/admin/cache")
+async def clear_cache():
+    require_loaded()
+    search_engine.invalidate_cache()
+    return search_engine.cache_stats()
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Prometheus text-format metrics"""
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
 
 @app.get("/health")
 async def health_check():
-    """Health check endpoint"""
+    """Health check endpoint, answered as soon as the port is bound; 503 once --fast-start loading has failed"""
+    if app.state.load_failed:
+        return JSONResponse({"status": "load_failed"}, status_code=503)
     return {"status": "healthy"}
 
+@app.get("/ready")
+async def readiness_check():
+    """Readiness endpoint, 503 until this worker has loaded its models and finished its warmup search"""
+    if not app.state.loaded:
+        return JSONResponse({"status": "loading"}, status_code=503)
+    if not app.state.ready:
+        return JSONResponse({"status": "warming_up"}, status_code=503)
+    return {"status": "ready", "pid": os.getpid()}
+
+app.add_middleware(MetricsMiddleware, paths=[route.path for route in app.routes])
+
+def torch_threads() -> int:
+    return args.torch_threads or max(1, (os.cpu_count() or 1) // args.workers)
+
+def init_worker(slot: int) -> None:
+    # Forked tokenizers can't reuse the parent's thread pool.
+    os.environ["TOKENIZERS_PARALLELISM"] = "false"
+    splade.set_num_threads(torch_threads())
+    print(f"Worker {slot} (pid {os.getpid()}) using {torch_threads()} torch threads")
+
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    config = uvicorn.Config(app, host=args.host, port=args.port, limit_max_requests=args.max_requests_per_worker)
+    if args.workers > 1:
+        # No forward pass may run in the parent: OpenMP thread pools do not survive fork.
+        PreforkServer(config, args.workers, on_worker_start=init_worker).run()
+    else:
+        if args.torch_threads and splade is not None:
+            splade.set_num_threads(args.torch_threads)
+        server = uvicorn.Server(config)
+        server.run()
+        if app.state.load_failed:
+            sys.exit(1)
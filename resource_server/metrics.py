@@ -0,0 +1,179 @@
+"""
+Minimal, low-overhead Prometheus-style metrics.
+
+Observations are a bisect plus a few integer/float updates under a lock, so
+they can sit on the hot path. Everything is rendered in the Prometheus text
+exposition format by `REGISTRY.render()`.
+"""
+
+import bisect
+import threading
+import time
+from typing import Callable, Iterable
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+
+def _format_labels(labels: tuple[tuple[str, str], ...], extra: str = "") -> str:
+    parts = [f'{key}="{value}"' for key, value in labels]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1) -> None:
+        with self._lock:
+            self.value += amount
+
+    def samples(self, name: str, labels) -> Iterable[str]:
+        yield f"{name}_total{_format_labels(labels)} {_format_value(self.value)}"
+
+class Gauge:
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1) -> None:
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount: float = 1) -> None:
+        with self._lock:
+            self.value -= amount
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+    def samples(self, name: str, labels) -> Iterable[str]:
+        yield f"{name}{_format_labels(labels)} {_format_value(self.value)}"
+
+class Histogram:
+    def __init__(self, buckets: tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += value
+            self.count += 1
+
+    def samples(self, name: str, labels) -> Iterable[str]:
+        with self._lock:
+            counts = list(self.counts)
+            total, count = self.sum, self.count
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += bucket_count
+            le = 'le="' + _format_value(bound) + '"'
+            yield f"{name}_bucket{_format_labels(labels, le)} {cumulative}"
+        yield f"{name}_sum{_format_labels(labels)} {_format_value(total)}"
+        yield f"{name}_count{_format_labels(labels)} {count}"
+
+class MetricsRegistry:
+    def __init__(self):
+        self._families: dict[str, tuple[str, str, dict]] = {}
+        self._collectors: list[Callable[[], Iterable[tuple[str, str, str, dict, float]]]] = []
+        self._lock = threading.Lock()
+
+    def _get(self, kind: str, name: str, help: str, labels: dict[str, str] | None, factory):
+        key = tuple(sorted((labels or {}).items()))
+        with self._lock:
+            family = self._families.setdefault(name, (kind, help, {}))
+            if family[0] != kind:
+                raise ValueError(f"Metric {name} already registered as a {family[0]}")
+            children = family[2]
+            if key not in children:
+                children[key] = factory()
+            return children[key]
+
+    def counter(self, name: str, help: str, labels: dict[str, str] | None = None) -> Counter:
+        return self._get("counter", name, help, labels, Counter)
+
+    def gauge(self, name: str, help: str, labels: dict[str, str] | None = None) -> Gauge:
+        return self._get("gauge", name, help, labels, Gauge)
+
+    def histogram(self, name: str, help: str, labels: dict[str, str] | None = None, buckets: tuple[float, ...] = LATENCY_BUCKETS) -> Histogram:
+        return self._get("histogram", name, help, labels, lambda: Histogram(buckets))
+
+    def register_collector(self, collector: Callable[[], Iterable[tuple[str, str, str, dict, float]]]) -> None:
+        """Register a callback yielding (name, kind, help, labels, value) samples computed at scrape time."""
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            families = [(name, kind, help, list(children.items())) for name, (kind, help, children) in self._families.items()]
+        for name, kind, help, children in families:
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, metric in children:
+                lines.extend(metric.samples(name, labels))
+        collected: dict[str, tuple[str, str, list]] = {}
+        for collector in self._collectors:
+            for name, kind, help, labels, value in collector():
+                collected.setdefault(name, (kind, help, []))[2].append((tuple(sorted(labels.items())), value))
+        for name, (kind, help, samples) in collected.items():
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            suffix = "_total" if kind == "counter" else ""
+            for labels, value in samples:
+                lines.append(f"{name}{suffix}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+REGISTRY = MetricsRegistry()
+
+def stage_histogram(stage: str) -> Histogram:
+    return REGISTRY.histogram(
+        "resource_server_stage_seconds", "Time spent in each stage of serving /resources", {"stage": stage}
+    )
+
+class MetricsMiddleware:
+    """ASGI middleware counting in-flight requests and timing each one by route."""
+
+    def __init__(self, app, paths: Iterable[str]):
+        self.app = app
+        self.paths = set(paths)
+        self.in_flight = REGISTRY.gauge("resource_server_requests_in_flight", "Requests currently being served")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        path = scope["path"] if scope["path"] in self.paths else "other"
+        status = {"code": 500}
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        self.in_flight.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            self.in_flight.dec()
+            labels = {"path": path, "method": scope["method"]}
+            REGISTRY.histogram(
+                "resource_server_request_seconds", "End-to-end request latency", labels
+            ).observe(time.perf_counter() - start)
+            REGISTRY.counter(
+                "resource_server_requests", "Requests served", dict(labels, status=str(status["code"]))
+            ).inc()
+
+def server_timing(timings: dict[str, float]) -> str:
+    return ", ".join(f"{stage};dur={seconds * 1000:.2f}" for stage, seconds in timings.items())
@@ -0,0 +1,103 @@
+"""
+Pre-fork serving: the parent process loads models and indexes once, binds
+the listening socket and forks workers that serve from it. Model weights,
+memory-mapped corpora and frozen Python objects are shared copy-on-write
+instead of being loaded once per worker.
+
+The parent respawns workers that exit, so uvicorn's `limit_max_requests`
+recycles workers gracefully. SIGHUP triggers a rolling restart, one worker at
+a time; SIGINT/SIGTERM shut every worker down gracefully.
+"""
+
+import gc
+import os
+import signal
+import sys
+import time
+import traceback
+from typing import Callable
+
+import uvicorn
+
+class PreforkServer:
+    def __init__(self, config: uvicorn.Config, workers: int, on_worker_start: Callable[[int], None] | None = None):
+        self.config = config
+        self.workers = workers
+        self.on_worker_start = on_worker_start
+        self.children: dict[int, int] = {}
+        self.stopping = False
+        self._recycle: list[int] = []
+
+    def run(self) -> None:
+        self.socket = self.config.bind_socket()
+        # Keep the collector from touching (and so un-sharing) everything loaded so far.
+        gc.freeze()
+        for slot in range(self.workers):
+            self._spawn(slot)
+
+        signal.signal(signal.SIGINT, self._handle_stop)
+        signal.signal(signal.SIGTERM, self._handle_stop)
+        signal.signal(signal.SIGHUP, self._handle_recycle)
+        print(f"Pre-fork server {os.getpid()} serving on {self.config.host}:{self.config.port} with {self.workers} workers")
+
+        while self.children:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            slot = self.children.pop(pid, None)
+            if slot is None:
+                continue
+            exit_code = os.waitstatus_to_exitcode(status)
+            if exit_code > 0 and not self.stopping:
+                # Don't spin if workers crash on startup.
+                time.sleep(1)
+            if not self.stopping:
+                print(f"Worker {pid} exited with status {exit_code}, respawning")
+                self._spawn(slot)
+                self._recycle_next()
+        self.socket.close()
+
+    def _spawn(self, slot: int) -> None:
+        pid = os.fork()
+        if pid:
+            self.children[pid] = slot
+            return
+        exit_code = 0
+        try:
+            for signum in (signal.SIGINT, signal.SIGTERM, signal.SIGHUP):
+                signal.signal(signum, signal.SIG_DFL)
+            if self.on_worker_start is not None:
+                self.on_worker_start(slot)
+            uvicorn.Server(self.config).run(sockets=[self.socket])
+        except BaseException:
+            traceback.print_exc()
+            exit_code = 1
+        finally:
+            # Never return into the parent's code path or run its atexit hooks.
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(exit_code)
+
+    def _handle_stop(self, signum, frame) -> None:
+        self.stopping = True
+        for pid in list(self.children):
+            self._signal(pid, signal.SIGTERM)
+
+    def _handle_recycle(self, signum, frame) -> None:
+        if not self._recycle:
+            self._recycle = list(self.children)
+            self._recycle_next()
+
+    def _recycle_next(self) -> None:
+        while self._recycle:
+            pid = self._recycle.pop(0)
+            if pid in self.children:
+                self._signal(pid, signal.SIGTERM)
+                return
+
+    def _signal(self, pid: int, signum: int) -> None:
+        try:
+            os.kill(pid, signum)
+        except ProcessLookupError:
+            pass
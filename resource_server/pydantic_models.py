@@ -1,8 +1,23 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
+
+class FullTextSpec(BaseModel):
+    """
+    A full-text request for part of a document. Offsets and lengths count
+    UTF-8 bytes. With `snippet`, the window of `length` bytes is centred on the
+    snippet's first occurrence at or after `start` (or starts at `start` when
+    it does not occur); without it, the window starts at `start`.
+    """
+    url: str
+    start: int = Field(default=0, ge=0)
+    length: int | None = Field(default=None, ge=0)
+    snippet: str | None = None
+
+    def key(self) -> tuple:
+        return (self.url, self.start, self.length, self.snippet)
 
 class ResourcesRequest(BaseModel):
     search_queries: list[str]
-    full_text_requests: list[str]
+    full_text_requests: list[str | FullTextSpec]
 
 class SearchResult(BaseModel):
     page: str
@@ -14,9 +29,30 @@ class SearchRound(BaseModel):
 
 class FullTextRequest(BaseModel):
     url: str
-    text: str
+    text: str | None = None
+    # Only set for FullTextSpec requests: byte offset of `text` and size of the whole document
+    start: int | None = None
+    total_bytes: int | None = None
 
 class ResourcesResponse(BaseModel):
     search_results: list[SearchRound]
     full_text_requests: list[FullTextRequest]
 
+
+class ElementMatch(BaseModel):
+    x: int
+    y: int
+    width: int
+    height: int
+    confidence: float
+    template: str
+
+class LocatedElement(BaseModel):
+    element_id: str
+    matches: list[ElementMatch]
+
+class LocateResponse(BaseModel):
+    width: int
+    height: int
+    elements: list[LocatedElement]
+    timings: dict[str, float]
@@ -0,0 +1,223 @@
+import hashlib
+import heapq
+import itertools
+import math
+import os
+import re
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, NamedTuple
+
+from metrics import REGISTRY
+
+class Hit(NamedTuple):
+    page: str
+    text: str
+    score: float
+
+class RetrievalBackend(ABC):
+    """Index that SearchEngine runs its (already expanded) queries against."""
+
+    @abstractmethod
+    def search_batch(self, queries: list[str], top_k: int) -> list[list[Hit]]:
+        ...
+
+    def reload(self) -> None:
+        pass
+
+class NeuralDBBackend(RetrievalBackend):
+    def __init__(self, db_path: str, license_key: str):
+        from thirdai import licensing
+        from thirdai import neural_db_v2 as ndb
+
+        self._ndb = ndb
+        print(f"Activating license {license_key}")
+        licensing.activate(license_key)
+        self.db_path = db_path
+        self.db = ndb.NeuralDB.load(db_path)
+
+    def reload(self) -> None:
+        self.db = self._ndb.NeuralDB.load(self.db_path)
+
+    def search_batch(self, queries: list[str], top_k: int) -> list[list[Hit]]:
+        results = self.db.search_batch(queries=queries, top_k=top_k)
+        return [
+            [
+                Hit(
+                    page=chunk.document,
+                    text=chunk.metadata["original"] if chunk.metadata and "original" in chunk.metadata else chunk.text,
+                    score=float(score),
+                )
+                for chunk, score in query_results
+            ]
+            for query_results in results
+        ]
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+def tokenize(text: str) -> list[str]:
+    return TOKEN_PATTERN.findall(text.lower())
+
+def split_passages(text: str, passage_words: int) -> list[str]:
+    words = text.split()
+    return [" ".join(words[start:start + passage_words]) for start in range(0, len(words), passage_words)]
+
+class BM25Index(NamedTuple):
+    pages: list[str]
+    passages: list[str]
+    lengths: list[int]
+    avg_length: float
+    postings: dict[str, list[tuple[int, int]]]
+    idf: dict[str, float]
+
+class BM25Backend(RetrievalBackend):
+    """
+    Pure in-memory Okapi BM25 over the url -> text corpus, split into
+    passages of `passage_words` words. A license-free stand-in for NeuralDB
+    in benchmarks and regression tests.
+
+    The index is built once from the corpus handed in at startup; `reload`
+    is a no-op because there is no source on disk to pick up changes from.
+    """
+
+    def __init__(self, url_to_text, passage_words: int = 200, k1: float = 1.2, b: float = 0.75):
+        self.passage_words = passage_words
+        self.k1 = k1
+        self.b = b
+        self.index = self._build(url_to_text.items())
+
+    def reload(self) -> None:
+        # The corpus lives in memory and cannot have changed, so rebuilding would only cost time.
+        pass
+
+    def _build(self, items: Iterable[tuple[str, str]]) -> BM25Index:
+        pages = []
+        passages = []
+        lengths = []
+        postings: dict[str, list[tuple[int, int]]] = {}
+        for url, text in items:
+            if not text:
+                continue
+            for passage in split_passages(text, self.passage_words):
+                terms = Counter(tokenize(passage))
+                passage_id = len(passages)
+                for term, tf in terms.items():
+                    postings.setdefault(term, []).append((passage_id, tf))
+                pages.append(url)
+                passages.append(passage)
+                lengths.append(sum(terms.values()))
+
+        n = len(passages)
+        idf = {
+            term: math.log(1 + (n - len(plist) + 0.5) / (len(plist) + 0.5))
+            for term, plist in postings.items()
+        }
+        return BM25Index(pages, passages, lengths, sum(lengths) / n if n else 0.0, postings, idf)
+
+    def _search(self, query: str, top_k: int) -> list[Hit]:
+        index = self.index
+        scores: dict[int, float] = {}
+        for term, qtf in Counter(tokenize(query)).items():
+            plist = index.postings.get(term)
+            if plist is None:
+                continue
+            idf = index.idf[term]
+            for passage_id, tf in plist:
+                norm = self.k1 * (1 - self.b + self.b * index.lengths[passage_id] / index.avg_length)
+                scores[passage_id] = scores.get(passage_id, 0.0) + qtf * idf * tf * (self.k1 + 1) / (tf + norm)
+        best = heapq.nlargest(top_k, scores.items(), key=lambda item: item[1])
+        return [Hit(index.pages[i], index.passages[i], score) for i, score in best]
+
+    def search_batch(self, queries: list[str], top_k: int) -> list[list[Hit]]:
+        return [self._search(query, top_k) for query in queries]
+
+def shard_of(url: str, num_shards: int) -> int:
+    """Stable shard assignment of a page, the same in every process and run."""
+    return int.from_bytes(hashlib.blake2b(url.encode("utf-8"), digest_size=8).digest(), "little") % num_shards
+
+def split_corpus(url_to_text, num_shards: int) -> list[dict[str, str]]:
+    shards: list[dict[str, str]] = [{} for _ in range(num_shards)]
+    for url, text in url_to_text.items():
+        shards[shard_of(url, num_shards)][url] = text
+    return shards
+
+class ShardedBackend(RetrievalBackend):
+    """
+    Searches several backends, each holding part of the corpus, in parallel
+    and merges their top-k lists by score.
+
+    Every query batch goes to all shards at once on a thread pool (one thread
+    per shard, created in the process that searches, so it survives pre-fork);
+    each shard's hits come back best first, so `heapq.merge` yields the overall
+    top k without sorting everything. Per-shard search time is exported as
+    `resource_server_shard_seconds{shard=...}`. Scores must be comparable
+    across shards, which holds for shards of one corpus built the same way.
+    Native backends (NeuralDB) search in parallel; the pure-Python BM25
+    stand-in is serialized by the GIL and only gets smaller indexes.
+    """
+
+    def __init__(self, shards: list[RetrievalBackend]):
+        if not shards:
+            raise ValueError("ShardedBackend needs at least one shard")
+        self.shards = shards
+        self.shard_seconds = [
+            REGISTRY.histogram("resource_server_shard_seconds", "Search time per index shard", {"shard": str(i)})
+            for i in range(len(shards))
+        ]
+        self._executor: ThreadPoolExecutor | None = None
+        self._executor_pid: int | None = None
+        self._lock = threading.Lock()
+
+    def _pool(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None or self._executor_pid != os.getpid():
+                self._executor = ThreadPoolExecutor(len(self.shards), thread_name_prefix="shard")
+                self._executor_pid = os.getpid()
+            return self._executor
+
+    def reload(self) -> None:
+        for _ in self._pool().map(lambda shard: shard.reload(), self.shards):
+            pass
+
+    def _search_shard(self, i: int, queries: list[str], top_k: int) -> list[list[Hit]]:
+        start = time.perf_counter()
+        results = self.shards[i].search_batch(queries, top_k)
+        self.shard_seconds[i].observe(time.perf_counter() - start)
+        return results
+
+    def search_batch(self, queries: list[str], top_k: int) -> list[list[Hit]]:
+        pool = self._pool()
+        futures = [pool.submit(self._search_shard, i, queries, top_k) for i in range(len(self.shards))]
+        shard_results = [future.result() for future in futures]
+        return [
+            list(itertools.islice(
+                heapq.merge(*(results[q] for results in shard_results), key=lambda hit: -hit.score), top_k
+            ))
+            for q in range(len(queries))
+        ]
+
+RETRIEVAL_BACKENDS = ("neuraldb", "bm25")
+
+def make_retrieval_backend(
+    name: str, db_paths: str | list[str], license_key: str | None, url_to_text, shards: int = 1
+) -> RetrievalBackend:
+    """
+    A NeuralDB backend per `db_paths` entry, or a BM25 backend over
+    `url_to_text` split into `shards` parts; several shards are searched
+    through a ShardedBackend.
+    """
+    if isinstance(db_paths, str):
+        db_paths = [db_paths]
+    if name == "neuraldb":
+        backends = [NeuralDBBackend(db_path, license_key) for db_path in db_paths]
+    elif name == "bm25":
+        if shards > 1:
+            backends = [BM25Backend(part) for part in split_corpus(url_to_text, shards)]
+        else:
+            backends = [BM25Backend(url_to_text)]
+    else:
+        raise ValueError(f"Unknown retrieval backend {name!r}, expected one of {RETRIEVAL_BACKENDS}")
+    return backends[0] if len(backends) == 1 else ShardedBackend(backends)
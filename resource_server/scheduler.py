@@ -0,0 +1,157 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Callable
+
+from metrics import REGISTRY, SIZE_BUCKETS, stage_histogram
+from pydantic_models import SearchRound
+
+QUEUE_WAIT_SECONDS = stage_histogram("queue_wait")
+BATCH_SECONDS = stage_histogram("search_batch")
+BATCH_SIZE = REGISTRY.histogram(
+    "resource_server_search_batch_size", "Number of queries per micro-batch", buckets=SIZE_BUCKETS
+)
+QUEUE_DEPTH = REGISTRY.gauge("resource_server_search_queue_depth", "Search requests waiting for a batch")
+
+class BatcherStopped(Exception):
+    """Raised for searches still queued, or submitted, when the batcher stops."""
+
+@dataclass
+class _PendingSearch:
+    queries: list[str]
+    top_k: int
+    future: asyncio.Future
+    timings: dict[str, float] | None = None
+    enqueued_at: float = field(default_factory=time.perf_counter)
+
+class SearchBatcher:
+    """
+    Gathers the search queries of concurrent requests into micro-batches and
+    runs each batch as a single blocking search call on a worker executor, so
+    the event loop never runs the forward pass or the index lookup itself.
+
+    A batch is closed once it holds `max_batch_size` queries or `max_wait_ms`
+    has passed since its first request arrived. At most `num_workers` batches
+    are in flight; while they are busy, new requests keep accumulating into
+    the next batch.
+    """
+
+    def __init__(
+        self,
+        search_fn: Callable[[list[str], int, dict[str, float]], list[SearchRound]],
+        max_batch_size: int = 32,
+        max_wait_ms: float = 5.0,
+        num_workers: int = 1,
+    ):
+        self.search_fn = search_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.num_workers = num_workers
+        self._queue: asyncio.Queue[_PendingSearch] | None = None
+        self._executor: ThreadPoolExecutor | None = None
+        self._slots: asyncio.Semaphore | None = None
+        self._collector: asyncio.Task | None = None
+        self._inflight: set[asyncio.Task] = set()
+        self._stopped = False
+
+    async def start(self) -> None:
+        self._queue = asyncio.Queue()
+        self._slots = asyncio.Semaphore(self.num_workers)
+        self._executor = ThreadPoolExecutor(self.num_workers, thread_name_prefix="search")
+        self._collector = asyncio.create_task(self._collect())
+
+    async def stop(self) -> None:
+        """Finish the batches in flight and fail the searches still waiting for one."""
+        self._stopped = True
+        if self._collector is not None:
+            self._collector.cancel()
+            await asyncio.gather(self._collector, return_exceptions=True)
+        await asyncio.gather(*self._inflight, return_exceptions=True)
+        if self._queue is not None:
+            while not self._queue.empty():
+                pending = self._queue.get_nowait()
+                QUEUE_DEPTH.dec()
+                self._fail([pending])
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+
+    @staticmethod
+    def _fail(batch: list[_PendingSearch]) -> None:
+        for pending in batch:
+            if not pending.future.done():
+                pending.future.set_exception(BatcherStopped("Search batcher stopped"))
+
+    async def search(self, queries: list[str], top_k: int = 10, timings: dict[str, float] | None = None) -> list[SearchRound]:
+        """Search the queries in the next batch; `timings` receives queue wait and batch stage seconds."""
+        if not queries:
+            return []
+        if self._stopped:
+            raise BatcherStopped("Search batcher stopped")
+        future = asyncio.get_running_loop().create_future()
+        QUEUE_DEPTH.inc()
+        await self._queue.put(_PendingSearch(queries, top_k, future, timings))
+        return await future
+
+    async def _collect(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            await self._slots.acquire()
+            batch = [await self._queue.get()]
+            size = len(batch[0].queries)
+            deadline = loop.time() + self.max_wait
+            while size < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    pending = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                except asyncio.CancelledError:
+                    # Stopped while collecting: the batch already left the queue
+                    QUEUE_DEPTH.dec(len(batch))
+                    self._fail(batch)
+                    raise
+                batch.append(pending)
+                size += len(pending.queries)
+            QUEUE_DEPTH.dec(len(batch))
+            BATCH_SIZE.observe(size)
+            task = asyncio.create_task(self._run(batch))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+
+    async def _run(self, batch: list[_PendingSearch]) -> None:
+        loop = asyncio.get_running_loop()
+        started_at = time.perf_counter()
+        for pending in batch:
+            QUEUE_WAIT_SECONDS.observe(started_at - pending.enqueued_at)
+            if pending.timings is not None:
+                pending.timings["queue"] = started_at - pending.enqueued_at
+        try:
+            by_top_k: dict[int, list[_PendingSearch]] = {}
+            for pending in batch:
+                by_top_k.setdefault(pending.top_k, []).append(pending)
+            for top_k, group in by_top_k.items():
+                queries = [query for pending in group for query in pending.queries]
+                timings: dict[str, float] = {}
+                start = time.perf_counter()
+                try:
+                    rounds = await loop.run_in_executor(self._executor, self.search_fn, queries, top_k, timings)
+                except Exception as e:
+                    for pending in group:
+                        if not pending.future.done():
+                            pending.future.set_exception(e)
+                    continue
+                timings["search"] = time.perf_counter() - start
+                BATCH_SECONDS.observe(timings["search"])
+                offset = 0
+                for pending in group:
+                    if pending.timings is not None:
+                        pending.timings.update(timings)
+                    n = len(pending.queries)
+                    if not pending.future.done():
+                        pending.future.set_result(rounds[offset:offset + n])
+                    offset += n
+        finally:
+            self._slots.release()
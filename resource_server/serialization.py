@@ -0,0 +1,78 @@
+"""
+Response body encoding negotiated from the request's Accept and
+Accept-Encoding headers.
+
+Bodies are JSON, or MessagePack when the client accepts
+`application/msgpack` (MessagePack carries the long full-text strings as raw
+bytes instead of escaped JSON). They are compressed with zstd or gzip when
+the client accepts it and the body is large enough to be worth it. orjson,
+msgpack and zstandard are optional: without orjson JSON comes from pydantic,
+and MessagePack or zstd are simply not offered when their package is missing.
+"""
+
+import gzip
+
+from pydantic import BaseModel
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+JSON_MEDIA_TYPE = "application/json"
+MSGPACK_MEDIA_TYPE = "application/msgpack"
+MSGPACK_MEDIA_TYPES = (MSGPACK_MEDIA_TYPE, "application/x-msgpack")
+GZIP_LEVEL = 1
+ZSTD_LEVEL = 3
+
+def negotiate_media_type(accept: str | None) -> str:
+    if accept and msgpack is not None and any(media_type in accept for media_type in MSGPACK_MEDIA_TYPES):
+        return MSGPACK_MEDIA_TYPE
+    return JSON_MEDIA_TYPE
+
+def serialize(model: BaseModel, media_type: str) -> bytes:
+    # Optional response fields that were never set (e.g. excerpt offsets) are left out
+    if media_type == MSGPACK_MEDIA_TYPE:
+        return msgpack.packb(model.model_dump(exclude_unset=True))
+    if orjson is not None:
+        return orjson.dumps(model.model_dump(exclude_unset=True))
+    return model.model_dump_json(exclude_unset=True).encode("utf-8")
+
+def _accepted_encodings(accept_encoding: str) -> dict[str, float]:
+    encodings = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        encodings[name.strip().lower()] = quality
+    return encodings
+
+def negotiate_encoding(accept_encoding: str | None) -> str | None:
+    """Preferred content coding the client accepts: zstd, then gzip, else None."""
+    if not accept_encoding:
+        return None
+    accepted = _accepted_encodings(accept_encoding)
+    for encoding in ("zstd", "gzip"):
+        if encoding == "zstd" and zstandard is None:
+            continue
+        if accepted.get(encoding, accepted.get("*", 0.0)) > 0:
+            return encoding
+    return None
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "zstd":
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(body)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL)
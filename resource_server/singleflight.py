@@ -0,0 +1,69 @@
+import asyncio
+from typing import Awaitable, Callable, Hashable, TypeVar
+
+from metrics import REGISTRY
+
+T = TypeVar("T")
+V = TypeVar("V")
+
+class SingleFlight:
+    """
+    Coalesces identical in-flight work: while a key is being computed, other
+    requests for the same key wait for that computation instead of starting
+    their own.
+
+    `do_batch` computes all keys of one call that are not already in flight
+    with a single `fn` call, run as its own task so a disconnecting client
+    does not cancel work that other requests are waiting for. Nothing is kept
+    once a computation finishes; caching stays with the caller.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._inflight: dict[Hashable, asyncio.Future] = {}
+        self._coalesced = REGISTRY.counter(
+            "resource_server_coalesced", "Lookups served by an identical in-flight lookup", {"kind": name}
+        )
+
+    async def do_batch(
+        self,
+        items: list[T],
+        fn: Callable[[list[T]], Awaitable[list[V]]],
+        key: Callable[[T], Hashable] = lambda item: item,
+    ) -> list[V]:
+        """Return `fn`'s value for every item, computing only the keys nobody is computing yet."""
+        loop = asyncio.get_running_loop()
+        futures: dict[Hashable, asyncio.Future] = {}
+        missing: list[T] = []
+        for item in items:
+            k = key(item)
+            if k in futures:
+                continue
+            future = self._inflight.get(k)
+            if future is None:
+                future = self._inflight[k] = loop.create_future()
+                missing.append(item)
+            else:
+                self._coalesced.inc()
+            futures[k] = future
+        if missing:
+            task = asyncio.ensure_future(fn(missing))
+            task.add_done_callback(lambda task: self._settle(missing, key, task))
+        return [await asyncio.shield(futures[key(item)]) for item in items]
+
+    def _settle(self, missing: list, key: Callable, task: asyncio.Task) -> None:
+        error = None
+        if task.cancelled():
+            error = asyncio.CancelledError()
+        elif task.exception() is not None:
+            error = task.exception()
+        for i, item in enumerate(missing):
+            future = self._inflight.pop(key(item))
+            if future.done():
+                continue
+            if error is None:
+                future.set_result(task.result()[i])
+            else:
+                future.set_exception(error)
+                # Mark retrieved: every waiter may have gone away already
+                future.exception()
@@ -0,0 +1,249 @@
+"""
+Array-backed inverted index over SPLADE sparse document vectors.
+
+An index is a directory of flat arrays that are memory-mapped on load:
+
+    meta.json           document count, vocab size and weight quantization scale
+    term_offsets.npy    int64[vocab_size + 1], postings of term t are [offsets[t], offsets[t + 1])
+    doc_ids.npy         uint32[nnz], doc ids of every posting list, ascending within a term
+    weights.npy         uint8[nnz], quantized term weights (weight = q * scale)
+    term_max.npy        float32[vocab_size], largest weight of each term, for score upper bounds
+    page_ids.npy        uint32[num_docs], index into pages.json for every passage
+    pages.json          source URL of every page
+    text_offsets.npy    int64[num_docs + 1], byte ranges of each passage in passages.bin
+    passages.bin        utf-8 passage texts
+
+Queries are scored by dot product with MaxScore pruning: query terms are
+visited in decreasing order of their score upper bound and accumulated
+exhaustively only until the upper bound of the remaining terms can no
+longer lift a new document into the top k. The remaining (non-essential)
+terms are then only looked up for the surviving candidates.
+
+Build an index from url_to_text.json (or a text store) with:
+
+    python sparse_index.py --url-to-text-path resources/url_to_text.json --output resources/sparse-index
+"""
+
+import argparse
+import json
+import mmap
+import os
+import time
+
+import numpy as np
+
+from retrieval import Hit, split_passages
+
+class SparseIndex:
+    """
+    Searches the index at `path`. `reload` maps the files again into a new
+    _IndexFiles and publishes it with one assignment; a search reads that
+    reference once, so searches running during a reload finish on the old
+    arrays instead of mixing old and new ones.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._files = _IndexFiles(path)
+
+    def reload(self) -> None:
+        self._files = _IndexFiles(self.path)
+
+    def search(self, term_ids: np.ndarray, term_weights: np.ndarray, top_k: int) -> list[Hit]:
+        return self._files.search(term_ids, term_weights, top_k)
+
+class _IndexFiles:
+    """The memory-mapped arrays of one index directory, never modified after loading."""
+
+    def __init__(self, path: str):
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+        self.num_docs = meta["num_docs"]
+        self.vocab_size = meta["vocab_size"]
+        self.scale = meta["scale"]
+        load = lambda name: np.load(os.path.join(path, name), mmap_mode="r")
+        self.term_offsets = load("term_offsets.npy")
+        self.doc_ids = load("doc_ids.npy")
+        self.weights = load("weights.npy")
+        self.term_max = np.asarray(load("term_max.npy"))
+        self.page_ids = load("page_ids.npy")
+        self.text_offsets = load("text_offsets.npy")
+        with open(os.path.join(path, "pages.json")) as f:
+            self.pages = json.load(f)
+        with open(os.path.join(path, "passages.bin"), "rb") as f:
+            self._passages = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.fstat(f.fileno()).st_size else b""
+
+    def _postings(self, term: int) -> tuple[np.ndarray, np.ndarray]:
+        start, end = self.term_offsets[term], self.term_offsets[term + 1]
+        return self.doc_ids[start:end], self.weights[start:end]
+
+    def passage(self, doc_id: int) -> str:
+        start, end = self.text_offsets[doc_id], self.text_offsets[doc_id + 1]
+        return self._passages[start:end].decode("utf-8")
+
+    def search(self, term_ids: np.ndarray, term_weights: np.ndarray, top_k: int) -> list[Hit]:
+        if self.num_docs == 0 or len(term_ids) == 0:
+            return []
+        top_k = min(top_k, self.num_docs)
+        term_weights = term_weights * self.scale
+        bounds = term_weights * self.term_max[term_ids]
+        order = np.argsort(-bounds, kind="stable")
+        term_ids, term_weights, bounds = term_ids[order], term_weights[order], bounds[order]
+        # remaining[i] is the most that terms i.. can still add to any document's score.
+        remaining = np.append(np.cumsum(bounds[::-1])[::-1], 0.0)
+
+        scores = np.zeros(self.num_docs, dtype=np.float32)
+        # Scores only grow, so the top k after adding a posting list is among
+        # the previous top k and that list's docs: the threshold never needs
+        # a pass over all num_docs scores.
+        top_docs = np.zeros(0, dtype=np.int64)
+        touched: list[np.ndarray] = []
+        threshold = 0.0
+        essential = len(term_ids)
+        for i, (term, weight) in enumerate(zip(term_ids, term_weights)):
+            if i > 0 and remaining[i] < threshold:
+                essential = i
+                break
+            docs, weights = self._postings(term)
+            if len(docs) == 0:
+                continue
+            # Doc ids are unique within a posting list, so fancy-index addition is safe.
+            scores[docs] += weight * weights
+            touched.append(docs)
+            top_docs = self._top(np.union1d(top_docs, docs), scores, top_k)
+            if len(top_docs) == top_k:
+                threshold = float(scores[top_docs[-1]])
+
+        if essential < len(term_ids):
+            # remaining[essential] < threshold, so untouched (zero score) docs cannot qualify.
+            touched_docs = np.unique(np.concatenate(touched)).astype(np.int64)
+            candidates = touched_docs[scores[touched_docs] + remaining[essential] >= threshold]
+            candidate_scores = scores[candidates]
+            for term, weight in zip(term_ids[essential:], term_weights[essential:]):
+                docs, weights = self._postings(term)
+                if len(docs) == 0:
+                    continue
+                positions = np.searchsorted(docs, candidates)
+                found = positions < len(docs)
+                found[found] = docs[positions[found]] == candidates[found]
+                candidate_scores[found] += weight * weights[positions[found]]
+            scores[candidates] = candidate_scores
+            top_docs = self._top(candidates, scores, top_k)
+
+        return [
+            Hit(self.pages[self.page_ids[doc]], self.passage(doc), float(scores[doc]))
+            for doc in top_docs
+            if scores[doc] > 0
+        ]
+
+    @staticmethod
+    def _top(docs: np.ndarray, scores: np.ndarray, top_k: int) -> np.ndarray:
+        """The (at most) top_k of `docs` by score, best first; ties keep the lower doc id."""
+        docs = docs.astype(np.int64, copy=False)
+        if len(docs) > top_k:
+            docs = np.sort(docs[np.argpartition(-scores[docs], top_k - 1)[:top_k]])
+        return docs[np.argsort(-scores[docs], kind="stable")]
+
+def sparse_rows(scores: np.ndarray) -> list[tuple[np.ndarray, np.ndarray]]:
+    """Split a (batch, vocab) SPLADE weight matrix into per-row (term ids, weights)."""
+    rows = []
+    for row in scores:
+        ids = np.flatnonzero(row)
+        rows.append((ids.astype(np.int64), row[ids].astype(np.float32)))
+    return rows
+
+def build_sparse_index(url_to_text, splade, output_path: str, passage_words: int = 200, batch_size: int = 16) -> None:
+    pages: list[str] = []
+    page_ids: list[int] = []
+    passages: list[bytes] = []
+    term_chunks: list[np.ndarray] = []
+    doc_chunks: list[np.ndarray] = []
+    weight_chunks: list[np.ndarray] = []
+
+    def flush(batch: list[str]) -> None:
+        first_doc = len(passages) - len(batch)
+        for offset, (ids, weights) in enumerate(sparse_rows(splade.encode(batch))):
+            term_chunks.append(ids)
+            doc_chunks.append(np.full(len(ids), first_doc + offset, dtype=np.uint32))
+            weight_chunks.append(weights)
+
+    start = time.perf_counter()
+    batch: list[str] = []
+    for url, text in url_to_text.items():
+        if not text:
+            continue
+        page_id = len(pages)
+        pages.append(url)
+        for passage in split_passages(text, passage_words):
+            page_ids.append(page_id)
+            passages.append(passage.encode("utf-8"))
+            batch.append(passage)
+            if len(batch) == batch_size:
+                flush(batch)
+                batch = []
+        if len(passages) and len(passages) % (batch_size * 50) == 0:
+            print(f"Encoded {len(passages)} passages ({time.perf_counter() - start:.1f}s)")
+    if batch:
+        flush(batch)
+
+    vocab_size = len(splade.tokenizer)
+    terms = np.concatenate(term_chunks) if term_chunks else np.zeros(0, dtype=np.int64)
+    docs = np.concatenate(doc_chunks) if doc_chunks else np.zeros(0, dtype=np.uint32)
+    weights = np.concatenate(weight_chunks) if weight_chunks else np.zeros(0, dtype=np.float32)
+    # Passages were encoded in doc id order, so a stable sort by term keeps each posting list ascending.
+    order = np.argsort(terms, kind="stable")
+    terms, docs, weights = terms[order], docs[order], weights[order]
+
+    max_weight = float(weights.max()) if len(weights) else 1.0
+    scale = max_weight / 255
+    quantized = np.clip(np.rint(weights / scale), 1, 255).astype(np.uint8)
+    term_offsets = np.zeros(vocab_size + 1, dtype=np.int64)
+    np.cumsum(np.bincount(terms, minlength=vocab_size), out=term_offsets[1:])
+    term_max = np.zeros(vocab_size, dtype=np.float32)
+    np.maximum.at(term_max, terms, quantized.astype(np.float32))
+    text_offsets = np.zeros(len(passages) + 1, dtype=np.int64)
+    np.cumsum([len(passage) for passage in passages], out=text_offsets[1:])
+
+    os.makedirs(output_path, exist_ok=True)
+    save = lambda name, array: np.save(os.path.join(output_path, name), array)
+    save("term_offsets.npy", term_offsets)
+    save("doc_ids.npy", docs)
+    save("weights.npy", quantized)
+    save("term_max.npy", term_max)
+    save("page_ids.npy", np.asarray(page_ids, dtype=np.uint32))
+    save("text_offsets.npy", text_offsets)
+    with open(os.path.join(output_path, "passages.bin"), "wb") as f:
+        for passage in passages:
+            f.write(passage)
+    with open(os.path.join(output_path, "pages.json"), "w") as f:
+        json.dump(pages, f)
+    with open(os.path.join(output_path, "meta.json"), "w") as f:
+        json.dump({
+            "num_docs": len(passages),
+            "vocab_size": vocab_size,
+            "scale": scale,
+            "passage_words": passage_words,
+            "nnz": int(len(docs)),
+        }, f, indent=2)
+    print(f"Indexed {len(passages)} passages from {len(pages)} pages, {len(docs)} postings, in {time.perf_counter() - start:.1f}s")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build a SPLADE sparse inverted index")
+    parser.add_argument("--url-to-text-path", type=str, default="resources/url_to_text.json")
+    parser.add_argument("--output", type=str, default="resources/sparse-index")
+    parser.add_argument("--splade-backend", type=str, choices=["torch", "torch-int8", "onnx"], default="torch")
+    parser.add_argument("--splade-onnx-path", type=str, default="resources/splade.onnx")
+    parser.add_argument("--passage-words", type=int, default=200)
+    parser.add_argument("--batch-size", type=int, default=16)
+    args = parser.parse_args()
+
+    from engine import TextRetriever
+    from splade import Splade
+
+    build_sparse_index(
+        TextRetriever(args.url_to_text_path).map,
+        Splade(args.splade_backend, args.splade_onnx_path),
+        args.output,
+        passage_words=args.passage_words,
+        batch_size=args.batch_size,
+    )
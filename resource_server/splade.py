@@ -1,29 +1,141 @@
+import os
+import time
+
 from transformers import AutoModelForMaskedLM, AutoTokenizer
+import numpy as np
 import torch
+from metrics import REGISTRY, SIZE_BUCKETS, stage_histogram
 
-class Splade:
-    def __init__(self):
-        self.model = AutoModelForMaskedLM.from_pretrained(
-            "naver/splade-cocondenser-selfdistil"
-        )
-        self.tokenizer = AutoTokenizer.from_pretrained(
-            "naver/splade-cocondenser-selfdistil"
-        )
+MODEL_NAME = "naver/splade-cocondenser-selfdistil"
+BACKENDS = ("torch", "torch-int8", "onnx")
 
-    def augment(self, text: str) -> str:
-        tokens = self.tokenizer(
-            text, return_tensors="pt", truncation=True, max_length=512
-        )
-        output = self.model(**tokens)["logits"]
+ENCODE_SECONDS = stage_histogram("splade_forward")
+ENCODE_BATCH_SIZE = REGISTRY.histogram(
+    "resource_server_splade_batch_size", "Number of texts per SPLADE forward pass", buckets=SIZE_BUCKETS
+)
+
+class SpladePooling(torch.nn.Module):
+    """MLM head followed by SPLADE's log-relu max-pooling, exported as one graph for ONNX."""
+
+    def __init__(self, model: torch.nn.Module):
+        super().__init__()
+        self.model = model
+
+    def forward(self, input_ids: torch.Tensor, attention_mask: torch.Tensor) -> torch.Tensor:
+        logits = self.model(input_ids=input_ids, attention_mask=attention_mask)["logits"]
         scores, _ = torch.max(
-            torch.log(1 + torch.relu(output)) * tokens["attention_mask"].unsqueeze(-1),
+            torch.log(1 + torch.relu(logits)) * attention_mask.unsqueeze(-1),
             dim=1,
         )
-        
-        tokens = scores.squeeze().nonzero().squeeze()
-        tokens = " ".join(
+        return scores
+
+class Splade:
+    def __init__(self, backend: str = "torch", onnx_path: str = "resources/splade.onnx"):
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown SPLADE backend {backend!r}, expected one of {BACKENDS}")
+        self.backend = backend
+        self.model_name = MODEL_NAME
+        self.onnx_path = onnx_path
+        self.tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME)
+        self.model = None
+        self.session = None
+
+        if backend == "onnx":
+            self.session = self._load_onnx(onnx_path)
+        else:
+            model = AutoModelForMaskedLM.from_pretrained(MODEL_NAME)
+            model.eval()
+            if backend == "torch-int8":
+                model = torch.ao.quantization.quantize_dynamic(
+                    model, {torch.nn.Linear}, dtype=torch.qint8
+                )
+            self.model = SpladePooling(model)
+
+    def _load_onnx(self, onnx_path: str, num_threads: int = 0):
+        try:
+            import onnxruntime as ort
+        except ImportError as e:
+            raise ImportError("The onnx SPLADE backend requires `pip install onnxruntime`") from e
+        if not os.path.exists(onnx_path):
+            export_onnx(onnx_path, self.tokenizer)
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.intra_op_num_threads = num_threads
+        return ort.InferenceSession(onnx_path, options, providers=["CPUExecutionProvider"])
+
+    def set_num_threads(self, num_threads: int) -> None:
+        """
+        Limit the intra-op threads of a forward pass. Forked workers must call
+        this before their first pass: it also rebuilds the ONNX session, whose
+        thread pool does not survive a fork.
+        """
+        torch.set_num_threads(num_threads)
+        if self.session is not None:
+            self.session = self._load_onnx(self.onnx_path, num_threads)
+
+    def encode(self, texts: list[str]) -> np.ndarray:
+        """Return the (len(texts), vocab_size) matrix of SPLADE term weights."""
+        start = time.perf_counter()
+        scores = self._encode(texts)
+        ENCODE_SECONDS.observe(time.perf_counter() - start)
+        ENCODE_BATCH_SIZE.observe(len(texts))
+        return scores
+
+    def _encode(self, texts: list[str]) -> np.ndarray:
+        if self.session is not None:
+            tokens = self.tokenizer(
+                texts, return_tensors="np", padding=True, truncation=True, max_length=512
+            )
+            return self.session.run(
+                ["scores"],
+                {
+                    "input_ids": tokens["input_ids"].astype(np.int64),
+                    "attention_mask": tokens["attention_mask"].astype(np.int64),
+                },
+            )[0]
+        tokens = self.tokenizer(
+            texts, return_tensors="pt", padding=True, truncation=True, max_length=512
+        )
+        with torch.inference_mode():
+            return self.model(tokens["input_ids"], tokens["attention_mask"]).numpy()
+
+    def augment(self, text: str) -> str:
+        return self.augment_batch([text])[0]
+
+    def augment_batch(self, texts: list[str]) -> list[str]:
+        if not texts:
+            return []
+        scores = self.encode(texts)
+        return [
+            self.expanded_text(text, np.flatnonzero(row))
+            for text, row in zip(texts, scores)
+        ]
+
+    def expanded_text(self, text: str, term_ids: np.ndarray) -> str:
+        """`text` followed by the expansion terms of its nonzero vocabulary ids, as augment_batch returns it."""
+        return text + " " + " ".join(
             t
-            for t in map(self.tokenizer._convert_id_to_token, tokens)
+            for t in self.tokenizer.convert_ids_to_tokens(term_ids.tolist())
             if not t.startswith("##")
         )
-        return text + " " + tokens
\ No newline at end of file
+
+def export_onnx(onnx_path: str, tokenizer=None) -> None:
+    tokenizer = tokenizer or AutoTokenizer.from_pretrained(MODEL_NAME)
+    model = AutoModelForMaskedLM.from_pretrained(MODEL_NAME)
+    model.eval()
+    sample = tokenizer(["sample query", "a longer sample query"], return_tensors="pt", padding=True)
+    os.makedirs(os.path.dirname(onnx_path) or ".", exist_ok=True)
+    print(f"Exporting SPLADE to {onnx_path}")
+    torch.onnx.export(
+        SpladePooling(model),
+        (sample["input_ids"], sample["attention_mask"]),
+        onnx_path,
+        input_names=["input_ids", "attention_mask"],
+        output_names=["scores"],
+        dynamic_axes={
+            "input_ids": {0: "batch", 1: "sequence"},
+            "attention_mask": {0: "batch", 1: "sequence"},
+            "scores": {0: "batch"},
+        },
+        opset_version=17,
+    )
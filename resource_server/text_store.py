@@ -0,0 +1,158 @@
+"""
+Compact, memory-mapped URL -> text store.
+
+File layout (all integers little endian):
+
+    header   MAGIC (8 bytes) | entry count (uint64)
+    index    count x (url hash uint64, record offset uint64, url length uint32, text length uint32),
+             sorted by url hash
+    data     url bytes followed by utf-8 text bytes for every record
+
+Lookups binary-search the index directly in the mapped file and decode only
+the requested texts, so opening a store costs neither parse time nor memory
+proportional to the corpus, and forked workers share the same page cache.
+Excerpts (`TextStore.excerpt`) search and decode only the requested window.
+
+Convert an existing url_to_text.json with:
+
+    python text_store.py resources/url_to_text.json resources/url_to_text.bin
+"""
+
+import argparse
+import hashlib
+import json
+import mmap
+import struct
+
+MAGIC = b"URLTXT01"
+HEADER = struct.Struct("<8sQ")
+ENTRY = struct.Struct("<QQII")
+
+SNIPPET_WINDOW = 2048
+
+def _is_continuation(buffer, i: int) -> bool:
+    return buffer[i] & 0xC0 == 0x80
+
+def excerpt(buffer, base: int, size: int, start: int = 0, length: int | None = None, snippet: str | None = None) -> tuple[str, int]:
+    """
+    Decode a window of the UTF-8 text stored at buffer[base:base + size]
+    (`buffer` is bytes or an mmap, which is searched in place).
+
+    Returns:
+        The excerpt and its byte offset in the text; the window is narrowed to
+        whole characters
+    """
+    start = min(start, size)
+    if snippet:
+        length = SNIPPET_WINDOW if length is None else length
+        found = buffer.find(snippet.encode("utf-8"), base + start, base + size)
+        if found >= 0:
+            start = max(0, found - base - max(0, length - len(snippet.encode("utf-8"))) // 2)
+    end = size if length is None else min(size, start + length)
+    while start < end and _is_continuation(buffer, base + start):
+        start += 1
+    while end < size and end > start and _is_continuation(buffer, base + end):
+        end -= 1
+    return bytes(buffer[base + start:base + end]).decode("utf-8"), start
+
+def url_hash(url: bytes) -> int:
+    return int.from_bytes(hashlib.blake2b(url, digest_size=8).digest(), "little")
+
+def is_text_store(path: str) -> bool:
+    with open(path, "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+def build_text_store(url_to_text: dict[str, str], output_path: str) -> None:
+    records = []
+    for url, text in url_to_text.items():
+        url_bytes = url.encode("utf-8")
+        records.append((url_hash(url_bytes), url_bytes, text.encode("utf-8")))
+    records.sort(key=lambda record: record[0])
+
+    offset = HEADER.size + ENTRY.size * len(records)
+    with open(output_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, len(records)))
+        for h, url_bytes, text_bytes in records:
+            f.write(ENTRY.pack(h, offset, len(url_bytes), len(text_bytes)))
+            offset += len(url_bytes) + len(text_bytes)
+        for _, url_bytes, text_bytes in records:
+            f.write(url_bytes)
+            f.write(text_bytes)
+
+class TextStore:
+    def __init__(self, path: str):
+        self._file = open(path, "rb")
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a text store")
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __contains__(self, url: str) -> bool:
+        return self.get(url) is not None
+
+    def _entry(self, i: int) -> tuple[int, int, int, int]:
+        return ENTRY.unpack_from(self._mm, HEADER.size + i * ENTRY.size)
+
+    def get(self, url: str) -> str | None:
+        location = self._locate(url)
+        if location is None:
+            return None
+        start, text_len = location
+        return self._mm[start:start + text_len].decode("utf-8")
+
+    def excerpt(self, url: str, start: int = 0, length: int | None = None, snippet: str | None = None) -> tuple[str, int, int] | None:
+        """Return (excerpt, byte offset, text bytes) of a window of a URL's text, see `excerpt`."""
+        location = self._locate(url)
+        if location is None:
+            return None
+        text_start, text_len = location
+        text, offset = excerpt(self._mm, text_start, text_len, start, length, snippet)
+        return text, offset, text_len
+
+    def _locate(self, url: str) -> tuple[int, int] | None:
+        """Offset and byte length of a URL's text in the mapped file."""
+        url_bytes = url.encode("utf-8")
+        h = url_hash(url_bytes)
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._entry(mid)[0] < h:
+                lo = mid + 1
+            else:
+                hi = mid
+        # Walk every entry sharing the hash in case of collisions.
+        while lo < self.count:
+            entry_hash, offset, url_len, text_len = self._entry(lo)
+            if entry_hash != h:
+                break
+            if self._mm[offset:offset + url_len] == url_bytes:
+                return offset + url_len, text_len
+            lo += 1
+        return None
+
+    def items(self):
+        for i in range(self.count):
+            _, offset, url_len, text_len = self._entry(i)
+            start = offset + url_len
+            yield (
+                self._mm[offset:start].decode("utf-8"),
+                self._mm[start:start + text_len].decode("utf-8"),
+            )
+
+    def close(self) -> None:
+        self._mm.close()
+        self._file.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert url_to_text.json into a memory-mapped text store")
+    parser.add_argument("json_path", type=str)
+    parser.add_argument("output_path", type=str)
+    args = parser.parse_args()
+
+    with open(args.json_path, "r") as f:
+        url_to_text = json.load(f)
+    build_text_store(url_to_text, args.output_path)
+    print(f"Wrote {len(url_to_text)} texts to {args.output_path}")
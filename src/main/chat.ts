@@ -17,7 +17,7 @@ interface SearchRound {
 
 interface FullTextRequest {
   url: string
-  text: string
+  text: string | null
 }
 
 interface AIResponse {